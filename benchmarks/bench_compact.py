@@ -0,0 +1,65 @@
+# coding: utf-8
+import random
+import tracemalloc
+
+from siebenapp.compact import CompactGoals
+from siebenapp.goaltree import Goals
+from benchmarks.common import measure, report
+
+
+def _exported(size, deleted=5, links=10, seed=42):
+    # every deleted-th goal id is a tombstone, as after months of use;
+    # goals are linked to random earlier ones, with a few extra links
+    rnd = random.Random(seed)
+    nodes, edges, alive = [(1, 'Root', True)], [], [1]
+    for i in range(2, size + 1):
+        if i % deleted == 0:
+            nodes.append((i, None, False))
+            continue
+        nodes.append((i, 'Goal %d' % i, True))
+        edges.append((rnd.choice(alive), i))
+        alive.append(i)
+    linked = set(edges)
+    for _ in range(size // links):
+        lower, upper = sorted(rnd.sample(alive, 2))
+        if (lower, upper) not in linked:
+            linked.add((lower, upper))
+            edges.append((lower, upper))
+    return nodes, edges, [('selection', 1), ('previous_selection', 1)]
+
+
+def _retained_memory(fn):
+    tracemalloc.start()
+    result = fn()
+    current = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, current
+
+
+def _megabytes(size):
+    return '%.1f MB' % (size / 2 ** 20)
+
+
+def bench_memory(sizes=(100000, 1000000)):
+    # the application calls all() on every refresh, which fills caches
+    rows = []
+    keys = 'name,edge,open,select,switchable'
+    for size in sizes:
+        nodes, edges, settings = _exported(size)
+        for goals_class in (Goals, CompactGoals):
+            goals, built = _retained_memory(lambda: goals_class.build(nodes, edges, settings, verify=False))
+            tracemalloc.start()
+            goals.all(keys)
+            cached = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            rows.append((size, goals_class.__name__, _megabytes(built), _megabytes(built + cached),
+                         measure(lambda: goals_class.build(nodes, edges, settings, verify=False), repeat=1),
+                         measure(lambda: goals.add('New', size - 1), repeat=1),
+                         measure(lambda: goals.all(keys), repeat=1)))
+            del goals
+    report('Memory held by goals with tombstones', rows,
+           ('goal ids', 'class', 'after build', 'after all', 'build', 'add', 'all'))
+
+
+if __name__ == '__main__':
+    bench_memory()
@@ -0,0 +1,136 @@
+# coding: utf-8
+import collections
+import os
+import random
+import sqlite3
+import tracemalloc
+from contextlib import closing
+from tempfile import NamedTemporaryFile, TemporaryDirectory
+
+from siebenapp.goaltree import Goals
+from siebenapp.system import ACTIONS, MIGRATIONS, run_migrations, write_events, load, save, \
+    save_snapshot, load_snapshot
+from benchmarks.common import generate_goals, measure, report
+
+
+def _fill(conn, size):
+    rnd = random.Random(42)
+    edges = [(rnd.randint(1, i - 1), i) for i in range(2, size + 1)]
+    with closing(conn.cursor()) as cur:
+        cur.executemany('insert into goals values (?,?,?)',
+                        ((i, 'Goal %d' % i, True) for i in range(1, size + 1)))
+        cur.executemany('insert into edges values (?,?)', edges)
+        cur.executemany('insert into settings values (?,?)',
+                        [('selection', 1), ('previous_selection', 1), ('zoom', 1)])
+    conn.commit()
+    return edges
+
+
+def _events(edges, count):
+    rnd = random.Random(1)
+    events = []
+    for parent, child in rnd.sample(edges, count):
+        events.append(('unlink', parent, child))
+        events.append(('delete', child))
+    return events
+
+
+def bench_save_updates(size=100000, count=200):
+    rows = []
+    for title, migrations in (('before', MIGRATIONS[:4]), ('after', MIGRATIONS)):
+        with closing(sqlite3.connect(':memory:')) as conn:
+            run_migrations(conn, migrations)
+            events = _events(_fill(conn, size), count)
+            elapsed = measure(lambda: write_events(collections.deque(events), conn), repeat=1)
+            rows.append((title, len(events), elapsed))
+    report('save_updates on a database with %d edges' % (size - 1), rows,
+           ('migration 4', 'events', 'seconds'))
+
+
+def _write_one_by_one(events, conn):
+    queries = dict(ACTIONS)
+    with closing(conn.cursor()) as cur:
+        for event in events:
+            for query in queries[event[0]]:
+                cur.execute(query, event[1:])
+    conn.commit()
+
+
+def bench_import_flush(sizes=(2000, 10000, 50000)):
+    rows = []
+    for size in sizes:
+        goals = generate_goals(1)
+        for i in range(2, size + 1):
+            goals.add('Goal %d' % i, (i - 1) // 3 + 1)
+        events = list(goals.events)
+        timings = []
+        for write in (_write_one_by_one, write_events):
+            with NamedTemporaryFile() as db, closing(sqlite3.connect(db.name)) as conn:
+                run_migrations(conn)
+                timings.append(measure(lambda: write(collections.deque(events), conn), repeat=1))
+        rows.append((size, len(events)) + tuple(timings))
+    report('Flush after a scripted import into a database file', rows, ('goals', 'events', 'one by one', 'executemany'))
+
+
+def _load_lists(filename):
+    # the way system.load worked before streaming was introduced
+    with closing(sqlite3.connect(filename)) as conn:
+        cur = conn.cursor()
+        goals = [row for row in cur.execute('select * from goals')]
+        edges = [row for row in cur.execute('select * from edges')]
+        settings = [row for row in cur.execute('select * from settings')]
+        return Goals.build(goals, edges, settings)
+
+
+def _load_streaming(filename, verify=True):
+    with closing(sqlite3.connect(filename)) as conn:
+        return Goals.build(conn.execute('select * from goals order by goal_id'),
+                           conn.execute('select * from edges'),
+                           conn.execute('select * from settings'),
+                           verify)
+
+
+def _peak_memory(fn):
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return '%.1f MB' % (peak / 2 ** 20)
+
+
+def bench_load(size=200000):
+    rows = []
+    with NamedTemporaryFile() as db:
+        with closing(sqlite3.connect(db.name)) as conn:
+            run_migrations(conn)
+            _fill(conn, size)
+        for title, fn in (('lists', lambda: _load_lists(db.name)),
+                          ('streaming', lambda: _load_streaming(db.name)),
+                          ('no verify', lambda: _load_streaming(db.name, verify=False)),
+                          ('system.load', lambda: load(db.name, verify=False))):
+            rows.append((title, measure(fn, repeat=1), _peak_memory(fn)))
+    report('Loading a database with %d goals' % size, rows, ('mode', 'seconds', 'peak memory'))
+
+
+def bench_snapshot(size=100000):
+    goals = generate_goals(size, links=size // 10)
+    for goal_id in range(size // 2, size // 2 + size // 10):
+        goals.delete(goal_id)
+    rows = []
+    with TemporaryDirectory() as tmp:
+        for title, write, read in (('sqlite', save, lambda f: load(f, verify=False).goaltree),
+                                   ('snapshot', save_snapshot, lambda f: load_snapshot(f, verify=False))):
+            filename = os.path.join(tmp, title)
+            saved = measure(lambda: write(goals, filename), repeat=1)
+            size_kb = '%d KB' % (os.path.getsize(filename) // 1024)
+            same = read(filename).all('name,edge,open') == goals.all('name,edge,open')
+            rows.append((title, saved, measure(lambda: read(filename)), size_kb, 'yes' if same else 'no'))
+    report('Storing %d goals with tombstones' % size, rows,
+           ('format', 'save', 'load', 'file size', 'same goals'))
+
+
+if __name__ == '__main__':
+    bench_save_updates()
+    bench_import_flush()
+    bench_load()
+    bench_snapshot()
@@ -0,0 +1,84 @@
+# coding: utf-8
+from html import escape
+from tempfile import TemporaryFile
+
+from siebenapp.system import dot_export, write_dot, split_long
+from benchmarks.common import generate_goals, measure, report
+
+
+def legacy_split_long(line):
+    margin = 20
+    parts = []
+    space_position = line.find(' ', margin)
+    while space_position > 0:
+        part, line = line[:space_position], line[(space_position + 1):]
+        parts.append(part)
+        space_position = line.find(' ', margin)
+    parts.append(line)
+    return '\n'.join(parts)
+
+
+def legacy_dot_export(goals):
+    # export as it was done before writing into a single buffer
+    data = goals.all(keys='open,name,edge,select,switchable')
+    lines = []
+    for num in sorted(data.keys()):
+        goal = data[num]
+        style = []
+        if goal['switchable'] and goal['open']:
+            style.append('bold')
+        goal_name = escape(goal['name'])
+        label = '"%d: %s"' % (num, goal_name) if num >= 0 else '"%s"' % goal_name
+        attributes = {
+            'label': legacy_split_long(label),
+            'color': 'red' if goal['open'] else 'green',
+            'fillcolor': {'select': 'gray', 'prev': 'lightgray'}.get(goal['select']),
+        }
+        if goal['select'] is not None:
+            style.append('filled')
+        if len(style) > 1:
+            attributes['style'] = '"%s"' % ','.join(style)
+        elif len(style) == 1:
+            attributes['style'] = style[0]
+        attributes_str = ', '.join(
+            '%s=%s' % (k, attributes[k])
+            for k in ['label', 'color', 'style', 'fillcolor']
+            if k in attributes and attributes[k]
+        )
+        lines.append('%d [%s];' % (num, attributes_str))
+    for num in sorted(data.keys()):
+        for edge in data[num]['edge']:
+            color = 'black' if data[edge]['open'] else 'gray'
+            line_attrs = 'color=%s' % color
+            if num < 0:
+                line_attrs += ', style=dashed'
+            lines.append('%d -> %d [%s];' % (edge, num, line_attrs))
+    return 'digraph g {\nnode [shape=box];\n%s\n}' % '\n'.join(lines)
+
+
+def bench_dot_export(sizes=(10000, 100000)):
+    rows = []
+    for size in sizes:
+        goals = generate_goals(size, links=size // 10)
+        goals.all(keys='open,name,edge,select,switchable')
+
+        def to_file():
+            with TemporaryFile('w') as out:
+                write_dot(goals, out)
+        rows.append((size, measure(lambda: legacy_dot_export(goals)),
+                     measure(lambda: dot_export(goals)), measure(to_file)))
+    report('DOT export', rows, ('goals', 'legacy', 'dot_export', 'write_dot'))
+
+
+def bench_split_long(lengths=(1000, 10000, 100000)):
+    rows = []
+    for length in lengths:
+        line = ('word ' * (length // 5))[:length]
+        rows.append((length, measure(lambda: legacy_split_long(line)),
+                     measure(lambda: split_long(line))))
+    report('Wrapping of a long name', rows, ('characters', 'legacy', 'split_long'))
+
+
+if __name__ == '__main__':
+    bench_dot_export()
+    bench_split_long()
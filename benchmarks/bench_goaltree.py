@@ -0,0 +1,74 @@
+# coding: utf-8
+import random
+
+from siebenapp.goaltree import Goals
+from benchmarks.common import generate_goals, measure, report
+
+
+def bench_all(sizes=(1000, 2000, 4000, 8000)):
+    rows, previous = [], None
+    for size in sizes:
+        goals = generate_goals(size, links=size // 10)
+        elapsed = measure(lambda: goals.all(keys='open,name,edge,select,switchable'))
+        ratio = '%.2f' % (elapsed / previous) if previous else '-'
+        rows.append((size, elapsed, ratio))
+        previous = elapsed
+    report('Goals.all() on growing trees (ratio ~2.0 means linear growth)',
+           rows, ('goals', 'seconds', 'ratio'))
+
+
+def bench_repeated_all(size=8000):
+    goals = generate_goals(size, links=size // 10)
+    keys = 'open,name,edge,select,switchable'
+    rows = [
+        ('first call', measure(lambda: goals.all(keys=keys), repeat=1)),
+        ('repeated', measure(lambda: goals.all(keys=keys))),
+    ]
+    goals.select(size // 2)
+    rows.append(('after select', measure(lambda: goals.all(keys=keys), repeat=1)))
+    report('Goals.all() on %d goals between mutations' % size, rows, ('call', 'seconds'))
+
+
+def bench_bulk_add(sizes=(10000, 20000, 40000)):
+    rows = []
+    for size in sizes:
+        def fill():
+            goals = Goals('Root')
+            for i in range(size):
+                goals.add('Goal %d' % i, 1)
+        elapsed = measure(fill, repeat=1)
+        rows.append((size, elapsed, '%.2f' % (elapsed * 1e6 / size)))
+    report('Bulk import into a single parent', rows, ('goals', 'seconds', 'us/goal'))
+
+
+def _bfs_reachable(goals, source, target):
+    front, visited = [source], {source}
+    while front:
+        goal = front.pop()
+        if goal == target:
+            return True
+        for e in goals.edges[goal]:
+            if e not in visited:
+                visited.add(e)
+                front.append(e)
+    return False
+
+
+def bench_cycle_checks(sizes=(2000, 8000, 32000), checks=2000):
+    rows = []
+    for size in sizes:
+        goals = generate_goals(size, links=size // 10)
+        rnd = random.Random(1)
+        for kind, top in (('random', size), ('near root', size // 100)):
+            pairs = [(rnd.randint(1, size), rnd.randint(1, top)) for _ in range(checks)]
+            bfs = measure(lambda: [_bfs_reachable(goals, u, l) for l, u in pairs], repeat=1)
+            indexed = measure(lambda: [goals._is_reachable(u, l) for l, u in pairs], repeat=1)  # pylint: disable=protected-access
+            rows.append((size, kind, bfs, indexed))
+    report('%d cycle checks for toggle_link' % checks, rows, ('goals', 'upper', 'full BFS', 'ordered'))
+
+
+if __name__ == '__main__':
+    bench_all()
+    bench_bulk_add()
+    bench_cycle_checks()
+    bench_repeated_all()
@@ -0,0 +1,40 @@
+# coding: utf-8
+from siebenapp.enumeration import Enumeration
+from siebenapp.system import dot_export
+from siebenapp.zoom import Zoom
+from benchmarks.common import generate_goals, measure, report
+
+
+def bench_attribute_access(count=100000):
+    goals = Enumeration(Zoom(generate_goals(10)))
+
+    def read_settings():
+        for _ in range(count):
+            goals.settings['selection']
+
+    def read_events():
+        for _ in range(count):
+            goals.events
+
+    def read_method():
+        for _ in range(count):
+            goals.toggle_link
+
+    rows = [(name, measure(fn)) for name, fn in (
+        ('settings', read_settings), ('events', read_events), ('toggle_link', read_method))]
+    report('%d attribute reads through Enumeration(Zoom(Goals))' % count, rows, ('attribute', 'seconds'))
+
+
+def bench_refresh(sizes=(500, 2000, 8000)):
+    rows = []
+    for size in sizes:
+        goals = Enumeration(Zoom(generate_goals(size, links=size // 10)))
+        goals.next_view()
+        goals.next_view()
+        rows.append((size, measure(lambda: dot_export(goals))))
+    report('Full refresh (dot_export in the full view)', rows, ('goals', 'seconds'))
+
+
+if __name__ == '__main__':
+    bench_attribute_access()
+    bench_refresh()
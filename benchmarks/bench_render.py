@@ -0,0 +1,88 @@
+# coding: utf-8
+from collections import defaultdict
+
+from siebenapp.render import min_width, count_crossings, minimize_crossings, render_tree, update_tree
+from benchmarks.common import generate_goals, measure, report
+
+
+def legacy_min_width(source, width):
+    # layering as it was done before the priority queue version
+    unsorted_goals, sorted_goals, goals_on_previous_layers = dict(source), set(), set()
+    layers = defaultdict(list)
+    current_layer, width_current, width_up = 0, 0, 0
+    while unsorted_goals:
+        candidates = [(goal, len(edges)) for goal, edges in unsorted_goals.items()
+                      if all(v in goals_on_previous_layers for v in edges)]
+        best_candidates = sorted(candidates, key=lambda x: x[1], reverse=True)
+        edges = 0
+        if best_candidates:
+            goal, edges = best_candidates[0]
+            unsorted_goals.pop(goal)
+            sorted_goals.add(goal)
+            layers[current_layer].append(goal)
+            back_edges = len([k for k, vs in source.items() if goal in vs])
+            width_current += 1 - edges
+            width_up += back_edges
+        must_go_up = (width_current >= width and edges < 1) or (width_up >= width)
+        if not best_candidates or must_go_up:
+            current_layer += 1
+            goals_on_previous_layers.update(sorted_goals)
+            width_current, width_up = width_up, 0
+    return dict(layers)
+
+
+def bench_min_width(sizes=(50, 200, 500, 2000, 20000), legacy_limit=2000):
+    rows = []
+    for size in sizes:
+        edges = {k: v['edge'] for k, v in generate_goals(size, links=size // 5).all('edge').items()}
+        layers = min_width(edges, 4)
+        elapsed = measure(lambda: min_width(edges, 4))
+        if size <= legacy_limit:
+            legacy_layers = legacy_min_width(edges, 4)
+            legacy_elapsed = measure(lambda: legacy_min_width(edges, 4), repeat=1)
+            same = 'yes' if legacy_layers == layers else 'no'
+        else:
+            legacy_elapsed, same = '-', '-'
+        rows.append((size, len(layers), max(len(v) for v in layers.values()),
+                     legacy_elapsed, elapsed, same))
+    report('Layering with width 4', rows,
+           ('goals', 'layers', 'max width', 'legacy', 'seconds', 'same layers'))
+
+
+def bench_crossings(sizes=(50, 200, 1000, 3000), sweeps=4):
+    rows = []
+    for size in sizes:
+        edges = {k: v['edge'] for k, v in generate_goals(size, links=size // 5).all('edge').items()}
+        layers = min_width(edges, 4)
+        ordered = minimize_crossings(edges, layers, sweeps)
+        rows.append((size, count_crossings(edges, layers), count_crossings(edges, ordered),
+                     measure(lambda: count_crossings(edges, layers)),
+                     measure(lambda: minimize_crossings(edges, layers, sweeps))))
+    report('Crossing minimization with %d sweeps' % sweeps, rows,
+           ('goals', 'crossings', 'minimized', 'count time', 'minimize time'))
+
+
+def bench_update_tree(sizes=(200, 1000, 5000)):
+    rows = []
+    for size in sizes:
+        goals = generate_goals(size, links=size // 5)
+        previous = render_tree(goals)
+        goals.rename('Renamed', size // 2)
+        goals.add('New', size // 2)
+        goals.events.clear()
+        graph, diff = update_tree(goals, previous)
+        full = render_tree(goals)
+        moved_by_full = sum(1 for g in full if g not in previous or
+                            (full[g]['row'], full[g]['col']) != (previous[g]['row'], previous[g]['col']))
+        rows.append((size, measure(lambda: render_tree(goals)),
+                     measure(lambda: update_tree(goals, graph)),
+                     measure(lambda: update_tree(goals, previous)),
+                     moved_by_full, len(diff['moved']) + len(diff['added'])))
+    report('Layout after adding one goal', rows,
+           ('goals', 'full', 'same structure', 'goal added', 'full changes', 'diff size'))
+
+
+if __name__ == '__main__':
+    bench_min_width()
+    bench_crossings()
+    bench_update_tree()
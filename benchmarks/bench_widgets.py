@@ -0,0 +1,60 @@
+# coding: utf-8
+import os
+import sys
+from os.path import dirname, join, realpath
+from tempfile import TemporaryDirectory
+
+# widgets are rendered without a display
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt5.QtCore import QCoreApplication, QEvent                  # pylint: disable=wrong-import-position
+from PyQt5.QtWidgets import QApplication                           # pylint: disable=wrong-import-position
+from PyQt5.uic import loadUi                                       # pylint: disable=wrong-import-position
+
+from siebenapp.app import SiebenAppDevelopment                     # pylint: disable=wrong-import-position
+from siebenapp.system import save                                  # pylint: disable=wrong-import-position
+from benchmarks.common import generate_goals, report               # pylint: disable=wrong-import-position
+
+ROOT = dirname(dirname(realpath(__file__)))
+
+
+def open_window(db):
+    w = loadUi(join(ROOT, 'ui', 'main-devel.ui'), SiebenAppDevelopment(db))
+    w.use_dot = False
+    w.about = loadUi(join(ROOT, 'ui', 'about.ui'))
+    w.setup()
+    return w
+
+
+def refresh(w, action):
+    action()
+    w.refresh.emit()
+    QCoreApplication.sendPostedEvents(None, QEvent.DeferredDelete)
+    return w.render_time
+
+
+def bench_native_render(sizes=(50, 200, 500, 1000)):
+    app = QApplication.instance() or QApplication(sys.argv)
+    rows = []
+    for size in sizes:
+        with TemporaryDirectory() as tmp:
+            db = join(tmp, 'bench.db')
+            save(generate_goals(size, links=size // 5), db)
+            w = open_window(db)
+            rows.append((
+                size,
+                w.render_time,
+                refresh(w, w.goals.hold_select),
+                refresh(w, lambda: w.goals.rename('Renamed')),
+                refresh(w, lambda: w.goals.add('New')),
+                refresh(w, w.goals.next_view),
+            ))
+            w.close_storage()
+            w.close()
+    app.processEvents()
+    report('Development mode refresh latency', rows,
+           ('goals', 'first', 'select', 'rename', 'add', 'next view'))
+
+
+if __name__ == '__main__':
+    bench_native_render()
@@ -0,0 +1,35 @@
+# coding: utf-8
+import random
+from timeit import default_timer
+
+from siebenapp.goaltree import Goals
+
+
+def generate_goals(size, links=0, seed=42):
+    rnd = random.Random(seed)
+    goals = Goals('Root')
+    for i in range(2, size + 1):
+        goals.add('Goal %d' % i, rnd.randint(1, i - 1))
+    for _ in range(links):
+        lower, upper = rnd.randint(1, size), rnd.randint(1, size)
+        goals.toggle_link(lower, upper)
+    goals.events.clear()
+    return goals
+
+
+def measure(fn, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = default_timer()
+        fn()
+        elapsed = default_timer() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def report(title, rows, header):
+    print(title)
+    print(' | '.join('%12s' % h for h in header))
+    for row in rows:
+        print(' | '.join('%12s' % (('%.6f' % v) if isinstance(v, float) else v) for v in row))
+    print()
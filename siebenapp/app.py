@@ -1,49 +1,120 @@
 #!/usr/bin/env python3
 # coding: utf-8
+import logging
 import sys
 from argparse import ArgumentParser
-from os.path import dirname, join, realpath
-from subprocess import run
+from concurrent.futures import ThreadPoolExecutor
+from os.path import dirname, isfile, join, realpath
+from timeit import default_timer
 
-from PyQt5.QtCore import pyqtSignal, Qt, QRect
+from PyQt5.QtCore import pyqtSignal, Qt, QRect, QTimer
 from PyQt5.QtGui import QImage, QPixmap, QPainter
-from PyQt5.QtWidgets import QApplication, QMainWindow, QWidget, QGridLayout
+from PyQt5.QtWidgets import QApplication, QMainWindow, QWidget, QGridLayout, QLabel
 from PyQt5.uic import loadUi
 
-from siebenapp.render import render_tree
-from siebenapp.system import save, load, dot_export, DEFAULT_DB, split_long
+from siebenapp.render import update_tree
+from siebenapp.system import Storage, RenderCache, load, dot_export, render_png, DEFAULT_DB, split_long, \
+    is_snapshot
 from siebenapp.ui.goalwidget import Ui_GoalBody
 
 
-class SiebenApp(QMainWindow):
+class SiebenApp(QMainWindow):                           # pylint: disable=too-many-instance-attributes
     refresh = pyqtSignal()
     quit_app = pyqtSignal()
+    image_ready = pyqtSignal(int, str, bytes, float)
+    task_failed = pyqtSignal(object)
 
-    def __init__(self, db):
+    def __init__(self, db, flush_events=1, flush_interval=None):
         super().__init__()
         self.refresh.connect(self.reload_image)
         self.quit_app.connect(QApplication.instance().quit)
+        self.image_ready.connect(self.show_image)
+        self.task_failed.connect(self.show_failure)
         self.db = db
         self.goals = load(db)
+        self.storage = Storage(db, flush_events, flush_interval)
+        # saving and rendering are done in background, one request at a time
+        self.worker = ThreadPoolExecutor(max_workers=1)
+        self.generation = 0
+        self.render_cache = RenderCache()
+        self.shown_image = None
+        QApplication.instance().aboutToQuit.connect(self.close_storage)
+        self.flush_timer = QTimer(self)
+        self.flush_timer.timeout.connect(self.flush_storage)
+        if flush_interval is not None:
+            self.flush_timer.start(flush_interval)
         self.use_dot = True
         self.force_refresh = True
+        self.render_time = None
+        # kept apart from status bar messages, so errors are not hidden by it
+        self.render_label = QLabel()
 
     def setup(self):
         self.action_About.triggered.connect(self.about.show)
+        self.statusbar.addPermanentWidget(self.render_label)
         self.refresh.emit()
 
     def reload_image(self):
         if not self.goals.events and not self.force_refresh:
             return
         self.force_refresh = False
-        save(self.goals, self.db)
+        start = default_timer()
+        # goals are read only here, the worker gets a snapshot of changes
+        batch = self.storage.take() if self.storage.collect(self.goals) else None
+        dot, key = None, ''
+        self.generation += 1
         if self.use_dot:
-            with open('work.dot', 'w') as f:
-                f.write(dot_export(self.goals))
-            run(['dot', '-Tpng', '-o', 'work.png', 'work.dot'])
-            img = QImage('work.png')
-            self.label.setPixmap(QPixmap.fromImage(img))
-            self.label.resize(img.size().width(), img.size().height())
+            # unchanged or recently seen graphs are not rendered again
+            dot = dot_export(self.goals)
+            key = RenderCache.key(dot)
+            png = self.render_cache.get(key)
+            if key == self.shown_image:
+                dot = None
+            elif png is not None:
+                self.show_image(self.generation, key, png, start)
+                dot = None
+        if batch is not None:
+            self.submit(self.storage.write, batch)
+        if dot is not None:
+            self.submit(self.render, self.generation, dot, key, start)
+
+    def submit(self, fn, *args):
+        self.worker.submit(fn, *args).add_done_callback(self.check_task)
+
+    def check_task(self, future):
+        # called in the worker thread; failed writes are restored by storage
+        if not future.cancelled() and future.exception() is not None:
+            self.task_failed.emit(future.exception())
+
+    def render(self, generation, dot, key, start):
+        # called in the worker thread
+        if generation == self.generation:
+            self.image_ready.emit(generation, key, render_png(dot), start)
+
+    def show_image(self, generation, key, png, start):
+        self.render_cache.put(key, png)
+        if generation != self.generation:
+            return
+        img = QImage.fromData(png, 'PNG')
+        self.label.setPixmap(QPixmap.fromImage(img))
+        self.label.resize(img.size().width(), img.size().height())
+        self.shown_image = key
+        self.show_render_time(start)
+
+    def show_render_time(self, start):
+        self.render_time = default_timer() - start
+        self.render_label.setText('Rendered in %.3f s' % self.render_time)
+
+    def show_failure(self, error):
+        logging.error('Background task failed', exc_info=error)
+        self.statusbar.showMessage('Error: %s' % error)
+
+    def flush_storage(self):
+        self.submit(self.storage.write, self.storage.take())
+
+    def close_storage(self):
+        self.worker.shutdown(wait=True)
+        self.storage.close()
 
     def keyPressEvent(self, event):
         key_handlers = {
@@ -133,6 +204,7 @@ class SiebenApp(QMainWindow):
 
 class GoalWidget(QWidget, Ui_GoalBody):
     clicked = pyqtSignal()
+    shown_attributes = ('name', 'open', 'select', 'switchable')
 
     def __init__(self):
         super().__init__()
@@ -148,6 +220,8 @@ class GoalWidget(QWidget, Ui_GoalBody):
             self.setStyleSheet('background-color:#808080;')
         elif selection == 'prev':
             self.setStyleSheet('background-color:#C0C0C0;')
+        else:
+            self.setStyleSheet('')
         frame_color = 'red' if attributes['open'] else 'green'
         self.frame.setStyleSheet('.QFrame{ border: 1px solid %s }' % frame_color)
 
@@ -198,9 +272,12 @@ class CentralWidget(QWidget):
 
 
 class SiebenAppDevelopment(SiebenApp):
-    def __init__(self, db):
-        super(SiebenAppDevelopment, self).__init__(db)
+    def __init__(self, db, flush_events=1, flush_interval=None):
+        super(SiebenAppDevelopment, self).__init__(db, flush_events, flush_interval)
         self.refresh.connect(self.native_render)
+        # widgets are reused between refreshes, keyed by goal id
+        self.widgets = dict()
+        self.graph = None
 
     def setup(self):
         super().setup()
@@ -210,6 +287,8 @@ class SiebenAppDevelopment(SiebenApp):
         # Also we have to disable pylint warning in order to make build green.
         self.scrollAreaWidgetContents = CentralWidget()         # pylint: disable=attribute-defined-outside-init
         # End of 'looks like dirty hack'
+        self.widgets.clear()
+        self.graph = None
         self.scrollArea.setWidget(self.scrollAreaWidgetContents)
         self.refresh.emit()
 
@@ -221,34 +300,55 @@ class SiebenAppDevelopment(SiebenApp):
         return inner
 
     def native_render(self):
-        for child in self.scrollAreaWidgetContents.children():
-            if isinstance(child, GoalWidget):
-                child.deleteLater()
-        graph = render_tree(self.goals)
+        start = default_timer()
+        previous = self.graph
+        graph, diff = update_tree(self.goals, previous, sweeps=4)
+        layout = self.scrollAreaWidgetContents.layout()
+        for goal_id in diff['removed']:
+            widget = self.widgets.pop(goal_id)
+            layout.removeWidget(widget)
+            widget.deleteLater()
         if 'setDependencies' in dir(self.scrollAreaWidgetContents):
             self.scrollAreaWidgetContents.setDependencies({g: graph[g]['edge'] for g in graph})
         for goal_id, attributes in graph.items():
-            widget = GoalWidget()
-            self.scrollAreaWidgetContents.layout().addWidget(widget, attributes['row'], attributes['col'])
-            widget.setup_data(goal_id, attributes)
-            widget.clicked.connect(self.select_number(goal_id))
-            widget.check_open.clicked.connect(self.close_goal(goal_id))
+            widget = self.widgets.get(goal_id)
+            if widget is None:
+                widget = self.widgets[goal_id] = GoalWidget()
+                layout.addWidget(widget, attributes['row'], attributes['col'])
+                widget.clicked.connect(self.select_number(goal_id))
+                widget.check_open.clicked.connect(self.close_goal(goal_id))
+            elif goal_id in diff['moved']:
+                layout.removeWidget(widget)
+                layout.addWidget(widget, attributes['row'], attributes['col'])
+            if goal_id in diff['added'] or \
+                    any(previous[goal_id][k] != attributes[k] for k in GoalWidget.shown_attributes):
+                widget.setup_data(goal_id, attributes)
+        self.graph = graph
         self.scrollAreaWidgetContents.update()
+        self.show_render_time(start)
 
 
 def main(root_script):
     parser = ArgumentParser()
     parser.add_argument('--devel', '-d', action='store_true', default=False,
                         help='Run in developer mode (affects GUI behavior)')
+    parser.add_argument('--flush-events', type=int, default=1,
+                        help='Write changes into the database after this number of events (1 by default)')
+    parser.add_argument('--flush-interval', type=int, default=None,
+                        help='Also write pending changes at least every given number of milliseconds')
     parser.add_argument('db', nargs='?', default=DEFAULT_DB,
                         help='Path to the database file (sieben.db by default)')
     args = parser.parse_args()
+    if isfile(args.db) and is_snapshot(args.db):
+        parser.error('%s is a read-only snapshot' % args.db)
     app = QApplication(sys.argv)
     root = dirname(realpath(root_script))
     if args.devel:
-        w = loadUi(join(root, 'ui', 'main-devel.ui'), SiebenAppDevelopment(args.db))
+        w = loadUi(join(root, 'ui', 'main-devel.ui'),
+                   SiebenAppDevelopment(args.db, args.flush_events, args.flush_interval))
     else:
-        w = loadUi(join(root, 'ui', 'main.ui'), SiebenApp(args.db))
+        w = loadUi(join(root, 'ui', 'main.ui'),
+                   SiebenApp(args.db, args.flush_events, args.flush_interval))
     w.use_dot = not args.devel
     w.about = loadUi(join(root, 'ui', 'about.ui'))
     w.setup()
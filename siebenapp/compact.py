@@ -0,0 +1,328 @@
+# coding: utf-8
+import collections
+from array import array
+from collections.abc import Mapping, Set
+
+from siebenapp.goaltree import BaseGoals
+
+GOAL_CLOSED, GOAL_OPEN, GOAL_DELETED = 0, 1, 2
+SWITCHABLE_UNKNOWN = 2
+
+
+class CompactGoals(BaseGoals):                          # pylint: disable=too-many-instance-attributes
+    # Same interface as Goals, but every goal id is an index in flat lists:
+    # names (None for deleted goals), a byte of state, position in the
+    # topological order and a number of open children. Id 0 is never used.
+    # Attributes are not cached, except switchable flags, which are kept
+    # in a byte per goal until the goal or its neighbours change.
+    def __init__(self, name):
+        self._names = [None]
+        self._state = bytearray(1)
+        self._order = array('I', [0])
+        self._open_children = array('I', [0])
+        self._children = _Adjacency()
+        self._parents = _Adjacency()
+        self._switchable = bytearray([SWITCHABLE_UNKNOWN])
+        super().__init__(name)
+
+    # read-only views for the code written against internals of Goals
+
+    @property
+    def goals(self):
+        return _NamesView(self._names)
+
+    @property
+    def edges(self):
+        return _LinksView(self._names, self._children)
+
+    @property
+    def parents(self):
+        return _LinksView(self._names, self._parents, set)
+
+    @property
+    def closed(self):
+        return _ClosedView(self._state)
+
+    @property
+    def _next_id(self):
+        return len(self._names)
+
+    def _exists(self, goal_id):
+        return 0 < goal_id < len(self._names) and self._names[goal_id] is not None
+
+    def _is_open(self, goal_id):
+        return self._state[goal_id] == GOAL_OPEN
+
+    def _children_of(self, goal_id):
+        return self._children.get(goal_id)
+
+    def _parents_of(self, goal_id):
+        return self._parents.get(goal_id)
+
+    def _position(self, goal_id):
+        return self._order[goal_id]
+
+    def _set_position(self, goal_id, position):
+        self._order[goal_id] = position
+
+    def _link(self, lower, upper):
+        self._children.add(lower, upper)
+        self._parents.add(upper, lower)
+
+    def _unlink(self, lower, upper):
+        self._children.remove(lower, upper)
+        self._parents.remove(upper, lower)
+
+    def _new_goal(self, name):
+        next_id = len(self._names)
+        self._names.append(name)
+        self._state.append(GOAL_OPEN)
+        self._order.append(next_id)
+        self._open_children.append(0)
+        self._switchable.append(SWITCHABLE_UNKNOWN)
+        return next_id
+
+    def _set_open(self, goal_id, is_open):
+        self._state[goal_id] = GOAL_OPEN if is_open else GOAL_CLOSED
+
+    def _drop(self, goal_id):
+        self._names[goal_id] = None
+        self._state[goal_id] = GOAL_DELETED
+        self._open_children[goal_id] = 0
+
+    def select(self, goal_id):
+        if self._exists(goal_id):
+            self.settings['selection'] = goal_id
+            self.events.append(('select', goal_id))
+
+    def hold_select(self):
+        self.settings['previous_selection'] = self.settings['selection']
+        self.events.append(('hold_select', self.settings['selection']))
+
+    def all(self, keys='name', ids=None):
+        keys = set(keys.split(','))
+        selection, previous = self.settings['selection'], self.settings['previous_selection']
+        result = dict()
+        if ids is None:
+            goals = enumerate(self._names)
+        else:
+            goals = ((g, self._names[g] if self._exists(g) else None) for g in sorted(ids))
+        for key, name in goals:
+            if name is None:
+                continue
+            value = result[key] = {}
+            if 'edge' in keys:
+                value['edge'] = sorted(self._children.get(key))
+            if 'name' in keys:
+                value['name'] = name
+            if 'open' in keys:
+                value['open'] = self._is_open(key)
+            if 'select' in keys:
+                value['select'] = 'select' if key == selection else 'prev' if key == previous else None
+            if 'switchable' in keys:
+                value['switchable'] = self._is_switchable(key)
+        return result
+
+    def _is_switchable(self, key):
+        switchable = self._switchable[key]
+        if switchable == SWITCHABLE_UNKNOWN:
+            if self._is_open(key):
+                switchable = not any(self._is_open(x) for x in self._children.get(key))
+            else:
+                back_references = self._parents.get(key)
+                switchable = not back_references or any(self._is_open(x) for x in back_references)
+            self._switchable[key] = switchable
+        return bool(switchable)
+
+    def _invalidate(self, *goal_ids):
+        for goal_id in goal_ids:
+            self._switchable[goal_id] = SWITCHABLE_UNKNOWN
+
+    def rename(self, new_name, goal_id=0):
+        if goal_id == 0:
+            goal_id = self.settings['selection']
+        self._names[goal_id] = new_name
+        self.events.append(('rename', new_name, goal_id))
+
+    def _build_order(self):
+        # unplaced goals keep position 0, as BaseGoals.verify expects
+        in_degree = array('i', bytes(4 * len(self._names)))
+        queue = collections.deque()
+        for goal, name in enumerate(self._names):
+            if name is not None:
+                in_degree[goal] = len(self._parents.get(goal))
+                if in_degree[goal] == 0:
+                    queue.append(goal)
+        self._order = array('I', bytes(4 * len(self._names)))
+        position = 0
+        while queue:
+            goal = queue.popleft()
+            position += 1
+            self._order[goal] = position
+            for child in self._children.get(goal):
+                in_degree[child] -= 1
+                if in_degree[child] == 0:
+                    queue.append(child)
+
+    def _build_top(self):
+        self._open_children = array('I', bytes(4 * len(self._names)))
+        self._top = set()
+        for goal, name in enumerate(self._names):
+            if name is not None:
+                self._open_children[goal] = sum(1 for c in self._children.get(goal) if self._is_open(c))
+                if self._open_children[goal] == 0 and self._is_open(goal):
+                    self._top.add(goal)
+
+    @staticmethod
+    def build(goals, edges, settings, verify=True):
+        # every argument is iterated only once, so cursors may be passed as is
+        # pylint: disable=protected-access
+        result = CompactGoals('')
+        result.events.clear()  # remove initial goal
+        names, state = [None], bytearray(1)
+        for goal_id, name, is_open in goals:
+            if goal_id >= len(names):
+                state.extend(bytes([GOAL_DELETED]) * (goal_id + 1 - len(names)))
+                names.extend([None] * (goal_id + 1 - len(names)))
+            names[goal_id] = name
+            if name is None:
+                state[goal_id] = GOAL_DELETED
+            else:
+                state[goal_id] = GOAL_OPEN if is_open else GOAL_CLOSED
+        sources, targets = array('I'), array('I')
+        for parent, child in edges:
+            sources.append(parent)
+            targets.append(child)
+        size = max(len(names), max(sources, default=0) + 1, max(targets, default=0) + 1)
+        state.extend(bytes([GOAL_DELETED]) * (size - len(names)))
+        names.extend([None] * (size - len(names)))
+        result._names, result._state = names, state
+        result._switchable = bytearray([SWITCHABLE_UNKNOWN]) * size
+        result._children = _Adjacency.from_pairs(sources, targets, size)
+        result._parents = _Adjacency.from_pairs(targets, sources, size)  # pylint: disable=arguments-out-of-order
+        return result._finish_build(settings, verify)
+
+    @staticmethod
+    def export(goals):
+        # pylint: disable=protected-access
+        nodes = [(g_id, name, goals._is_open(g_id))
+                 for g_id, name in enumerate(goals._names) if g_id > 0]
+        edges = [(parent, child) for parent in range(1, len(goals._names))
+                 for child in goals._children.get(parent)]
+        settings = list(goals.settings.items())
+        return nodes, edges, settings
+
+
+class _Adjacency:
+    # Linked goals of every goal in CSR form: goals linked to g are
+    # targets[offsets[g]:offsets[g + 1]]. Changes are kept aside in added
+    # lists and a set of removed pairs until there are enough of them to
+    # rebuild both arrays, which happens on the next read.
+    def __init__(self, offsets=None, targets=None):
+        self.offsets = array('I', [0]) if offsets is None else offsets
+        self.targets = array('I') if targets is None else targets
+        self.added = {}
+        self.removed = set()
+        self.changes = 0
+
+    @staticmethod
+    def from_pairs(sources, targets, size):
+        offsets = array('I', bytes(4 * (size + 1)))
+        for goal in sources:
+            offsets[goal + 1] += 1
+        for goal in range(size):
+            offsets[goal + 1] += offsets[goal]
+        positions = array('I', offsets)
+        linked = array('I', bytes(4 * len(targets)))
+        for goal, target in zip(sources, targets):
+            linked[positions[goal]] = target
+            positions[goal] += 1
+        return _Adjacency(offsets, linked)
+
+    def get(self, goal):
+        if self.changes > max(1024, len(self.targets) // 4):
+            self._rebuild()
+        if goal + 1 < len(self.offsets):
+            linked = self.targets[self.offsets[goal]:self.offsets[goal + 1]].tolist()
+            if self.removed:
+                linked = [g for g in linked if (goal, g) not in self.removed]
+        else:
+            linked = []
+        added = self.added.get(goal)
+        if added:
+            linked.extend(added)
+        return linked
+
+    def add(self, goal, target):
+        self.added.setdefault(goal, []).append(target)
+        self.changes += 1
+
+    def remove(self, goal, target):
+        added = self.added.get(goal)
+        if added and target in added:
+            added.remove(target)
+        else:
+            self.removed.add((goal, target))
+        self.changes += 1
+
+    def count(self):
+        return len(self.targets) - len(self.removed) + sum(len(g) for g in self.added.values())
+
+    def _rebuild(self):
+        size = max(len(self.offsets) - 1, max(self.added, default=-1) + 1)
+        self.changes = 0
+        offsets, targets = array('I', [0]), array('I')
+        for goal in range(size):
+            targets.extend(self.get(goal))
+            offsets.append(len(targets))
+        self.offsets, self.targets = offsets, targets
+        self.added, self.removed = {}, set()
+
+
+class _NamesView(Mapping):
+    def __init__(self, names):
+        self._names = names
+
+    def __getitem__(self, goal_id):
+        if 0 < goal_id < len(self._names):
+            return self._names[goal_id]
+        raise KeyError(goal_id)
+
+    def __iter__(self):
+        return iter(range(1, len(self._names)))
+
+    def __len__(self):
+        return len(self._names) - 1
+
+
+class _LinksView(Mapping):
+    def __init__(self, names, links, container=list):
+        self._names = names
+        self._links = links
+        self._container = container
+
+    def __getitem__(self, goal_id):
+        if 0 < goal_id < len(self._names) and self._names[goal_id] is not None:
+            return self._container(self._links.get(goal_id))
+        raise KeyError(goal_id)
+
+    def __iter__(self):
+        return (g for g, name in enumerate(self._names) if name is not None)
+
+    def __len__(self):
+        return sum(1 for name in self._names if name is not None)
+
+
+class _ClosedView(Set):
+    # deleted goals are closed too, as in Goals.closed
+    def __init__(self, state):
+        self._state = state
+
+    def __contains__(self, goal_id):
+        return 0 < goal_id < len(self._state) and self._state[goal_id] != GOAL_OPEN
+
+    def __iter__(self):
+        return (g for g in range(1, len(self._state)) if self._state[g] != GOAL_OPEN)
+
+    def __len__(self):
+        return sum(1 for g in range(1, len(self._state)) if self._state[g] != GOAL_OPEN)
@@ -1,52 +1,51 @@
 import math
 
 
-class Enumeration:
-    overriden = ['_goal_filter', '_id_mapping', '_update_mapping', 'all',
-                 'goaltree', 'next_view', 'select', 'selection_cache', 'view',
-                 'views']
-
+class Enumeration:                                      # pylint: disable=too-many-instance-attributes
     views = {'open': 'top', 'top': 'full', 'full': 'open'}
 
     def __init__(self, goaltree):
         self.goaltree = goaltree
+        # shared with the wrapped goaltree, read often enough to skip __getattr__
+        self.settings = goaltree.settings
+        self.events = goaltree.events
         self.selection_cache = []
         self.view = 'open'
+        self._mapping_key = None
+        self._forward, self._inverse, self._max_id = {}, {}, 0
         self._update_mapping()
 
-    def _update_mapping(self):
+    def _update_mapping(self, goals=None):
+        # mapping depends only on the set of shown goals, which may change
+        # together with the goaltree revision, the view or the zoom root;
+        # top goals are known without fetching goals, and the selection
+        # is moved to them before any goal is fetched
+        key = (self.goaltree.revision, self.view, self.settings.get('zoom'))
         if self.view == 'top':
-            goals = {k for k, v in self.goaltree.all(keys='open,switchable').items()
-                     if v['open'] and v['switchable']}
-            if goals and self.settings['selection'] not in goals:
-                self.goaltree.select(min(goals))
-            if goals and self.settings['previous_selection'] not in goals:
+            top_goals = self.goaltree.top_goals()
+            if top_goals and self.settings['selection'] not in top_goals:
+                self.goaltree.select(min(top_goals))
+            if top_goals and self.settings['previous_selection'] not in top_goals:
                 self.goaltree.hold_select()
-            self._goal_filter = goals
-        elif self.view == 'open':
-            self._goal_filter = {k for k, v in self.goaltree.all(keys='open').items() if v['open']}
+            self._goal_filter = top_goals
         else:
-            self._goal_filter = {g for g in self.goaltree.all()}
-
-    def _id_mapping(self, *args, **kwargs):
-        goals = self.goaltree.all(*args, **kwargs)
-        goals = {k:v for k, v in goals.items() if k in self._goal_filter}
-        if self.view == 'top':
-            for attrs in goals.values():
-                if 'edge' in attrs:
-                    attrs['edge'] = []
-        elif self.view == 'open':
-            for attrs in goals.values():
-                if 'edge' in attrs:
-                    attrs['edge'] = [e for e in attrs['edge'] if e in self._goal_filter]
-
-        m = {g: i + 1 for i, g in enumerate(sorted(g for g in goals if g > 0))}
-        length = len(m)
+            if goals is None:
+                if key == self._mapping_key:
+                    return
+                goals = self.goaltree.all(keys='open,switchable')
+            if self.view == 'open':
+                self._goal_filter = {k for k, v in goals.items() if v['open']}
+            else:
+                self._goal_filter = set(goals)
+        if key != self._mapping_key:
+            self._build_mapping()
+            self._mapping_key = key
 
-        def mapping_fn(goal_id):
-            if goal_id < 0:
-                return goal_id
-            goal_id = m[goal_id]
+    def _build_mapping(self):
+        ids = sorted(g for g in self._goal_filter if g > 0)
+        length = len(ids)
+        self._forward = {}
+        for goal_id, old_id in enumerate(ids, 1):
             new_id = goal_id % 10
             if length > 10:
                 new_id += 10 * ((goal_id - 1) // 10 + 1)
@@ -54,33 +53,54 @@ class Enumeration:
                 new_id += 100 * ((goal_id - 1) // 100 + 1)
             if length > 900:
                 new_id += 1000 * ((goal_id - 1) // 1000 + 1)
-            return new_id
+            self._forward[old_id] = new_id
+        self._inverse = {v: k for k, v in self._forward.items()}
+        self._max_id = max(self._inverse, default=0)
 
-        return goals, mapping_fn
+    def _mapping(self, goal_id):
+        return goal_id if goal_id < 0 else self._forward[goal_id]
 
-    def all(self, *args, **kwargs):
-        self._update_mapping()
+    def _filter(self, goals):
+        goals = {k: v for k, v in goals.items() if k in self._goal_filter}
+        if self.view == 'top':
+            for attrs in goals.values():
+                if 'edge' in attrs:
+                    attrs['edge'] = []
+        elif self.view == 'open':
+            for attrs in goals.values():
+                if 'edge' in attrs:
+                    attrs['edge'] = [e for e in attrs['edge'] if e in self._goal_filter]
+        return goals
+
+    def all(self, keys='name'):
+        # everything is computed from a single traversal of the goaltree,
+        # and only top goals are visited in the top view
+        requested = keys.split(',')
+        if self.view == 'top':
+            self._update_mapping()
+            goals = self.goaltree.all(keys, ids=self._goal_filter)
+        else:
+            goals = self.goaltree.all(keys + ',open')
+            self._update_mapping(goals)
         result = dict()
-        goals, mapping = self._id_mapping(*args, **kwargs)
-        for old_id, val in goals.items():
+        mapping = self._mapping
+        for old_id, val in self._filter(goals).items():
             new_id = mapping(old_id)
-            result[new_id] = dict((k, v) for k, v in val.items() if k != 'edge')
+            result[new_id] = dict((k, v) for k, v in val.items() if k != 'edge' and k in requested)
             if 'edge' in val:
                 result[new_id]['edge'] = [mapping(goal_id) for goal_id in val['edge']]
         return result
 
     def select(self, goal_id):
         self._update_mapping()
-        goals, mapping = self._id_mapping()
         if goal_id >= 10:
             self.selection_cache = []
         if self.selection_cache:
             goal_id = 10 * self.selection_cache.pop() + goal_id
-            if goal_id > max(mapping(k) for k in goals.keys()):
+            if goal_id > self._max_id:
                 goal_id %= int(pow(10, int(math.log(goal_id, 10))))
-        possible_selections = [g for g in goals if mapping(g) == goal_id]
-        if len(possible_selections) == 1:
-            self.goaltree.select(possible_selections[0])
+        if goal_id in self._inverse:
+            self.goaltree.select(self._inverse[goal_id])
             self.selection_cache = []
         else:
             self.selection_cache.append(goal_id)
@@ -90,9 +110,12 @@ class Enumeration:
         self._update_mapping()
         self.selection_cache.clear()
 
-    def __getattribute__(self, attr):
-        overriden = object.__getattribute__(self, 'overriden')
-        goaltree = object.__getattribute__(self, 'goaltree')
-        if attr in overriden:
-            return object.__getattribute__(self, attr)
-        return getattr(goaltree, attr)
+    def __getattr__(self, attr):
+        # only called for attributes not defined in Enumeration itself
+        if attr == 'goaltree':
+            raise AttributeError(attr)
+        value = getattr(self.goaltree, attr)
+        if callable(value):
+            # methods of the goaltree are bound once and never change
+            setattr(self, attr, value)
+        return value
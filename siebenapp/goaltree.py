@@ -2,11 +2,17 @@
 import collections
 
 
-class Goals:
+class BaseGoals:
+    # Logic shared by all goaltrees. Storage is left to subclasses, which
+    # give access to it through a few methods: _exists, _is_open,
+    # _children_of, _parents_of, _position and _set_position (order of goals),
+    # _link and _unlink (a pair of goals), _new_goal, _set_open and _drop
+    # (a goal itself), _invalidate (cached attributes) and the
+    # _open_children counters, indexed by goal id.
     def __init__(self, name):
-        self.goals = {}
-        self.edges = {}
-        self.closed = set()
+        self._top = set()
+        # incremented whenever the set of goals, their state or links change
+        self.revision = 0
         self.settings = {
             'selection': 1,
             'previous_selection': 1,
@@ -17,65 +23,25 @@ class Goals:
     def add(self, name, add_to=0):
         if add_to == 0:
             add_to = self.settings['selection']
-        if add_to in self.closed:
+        # the root goal is the only one added without a parent
+        if self._next_id > 1 and not (self._exists(add_to) and self._is_open(add_to)):
             return False
-        next_id = max(list(self.goals.keys()) + [0]) + 1
-        self.goals[next_id] = name
-        self.edges[next_id] = list()
+        next_id = self._new_goal(name)
+        self._top.add(next_id)
+        self.revision += 1
         self.events.append(('add', next_id, name, True))
         self.toggle_link(add_to, next_id)
         return True
 
-    def select(self, goal_id):
-        if goal_id in self.goals and self.goals[goal_id] is not None:
-            self.settings['selection'] = goal_id
-            self.events.append(('select', goal_id))
-
-    def hold_select(self):
-        self.settings['previous_selection'] = self.settings['selection']
-        self.events.append(('hold_select', self.settings['selection']))
-
-    def all(self, keys='name'):
-        def sel(x):
-            if x == self.settings['selection']:
-                return 'select'
-            elif x == self.settings['previous_selection']:
-                return 'prev'
-            return None
-        keys = keys.split(',')
-        result = dict()
-        for key, name in ((k, n) for k, n in self.goals.items() if n is not None):
-            back_references = [x for x, es in self.edges.items() if key in es]
-            switchable = (
-                (key not in self.closed and
-                 all(x in self.closed for x in self.edges[key])) or
-                (key in self.closed and (not back_references or
-                                         any(x for x in back_references if x not in self.closed))))
-            value = {
-                'edge': sorted(self.edges[key]),
-                'name': name,
-                'open': key not in self.closed,
-                'select': sel(key),
-                'switchable': switchable,
-            }
-            result[key] = {k: v for k, v in value.items() if k in keys}
-        return result
-
     def insert(self, name):
         if self.settings['selection'] == self.settings['previous_selection']:
             return
         if self.add(name, self.settings['previous_selection']):
-            key = len(self.goals)
+            key = self._next_id - 1
             self.toggle_link(key, self.settings['selection'])
-            if self.settings['selection'] in self.edges[self.settings['previous_selection']]:
+            if self.settings['selection'] in self._children_of(self.settings['previous_selection']):
                 self.toggle_link(self.settings['previous_selection'], self.settings['selection'])
 
-    def rename(self, new_name, goal_id=0):
-        if goal_id == 0:
-            goal_id = self.settings['selection']
-        self.goals[goal_id] = new_name
-        self.events.append(('rename', new_name, goal_id))
-
     def swap_goals(self):
         first, second = self.settings['selection'], self.settings['previous_selection']
         first_name, second_name = self.goals[first], self.goals[second]
@@ -83,118 +49,381 @@ class Goals:
         self.rename(second_name, first)
 
     def toggle_close(self):
-        if self.settings['selection'] in self.closed:
+        selection = self.settings['selection']
+        if not self._is_open(selection):
             if self._may_be_reopened():
-                self.closed.remove(self.settings['selection'])
-                self.events.append(('toggle_close', True, self.settings['selection']))
+                self._set_open(selection, True)
+                self._invalidate_around(selection)
+                self._count_open_child(selection, 1)
+                self.revision += 1
+                self.events.append(('toggle_close', True, selection))
         else:
             if self._may_be_closed():
-                self.closed.add(self.settings['selection'])
-                self.events.append(('toggle_close', False, self.settings['selection']))
+                self._set_open(selection, False)
+                self._invalidate_around(selection)
+                self._count_open_child(selection, -1)
+                self.revision += 1
+                self.events.append(('toggle_close', False, selection))
                 self.select(1)
                 self.hold_select()
 
+    def _invalidate_around(self, goal_id):
+        self._invalidate(goal_id, *self._children_of(goal_id))
+        self._invalidate(*self._parents_of(goal_id))
+
+    def _count_open_child(self, goal_id, delta):
+        for parent in self._parents_of(goal_id):
+            self._open_children[parent] += delta
+            self._update_top(parent)
+        self._update_top(goal_id)
+
+    def _update_top(self, goal_id):
+        if self._is_open(goal_id) and self._open_children[goal_id] == 0:
+            self._top.add(goal_id)
+        else:
+            self._top.discard(goal_id)
+
+    def top_goals(self):
+        return set(self._top)
+
     def _may_be_closed(self):
-        return all(g in self.closed for g in self.edges[self.settings['selection']])
+        return not any(self._is_open(g) for g in self._children_of(self.settings['selection']))
 
     def _may_be_reopened(self):
-        parent_goals = [g for g, v in self.edges.items() if self.settings['selection'] in v]
-        return all(g not in self.closed for g in parent_goals)
+        return all(self._is_open(g) for g in self._parents_of(self.settings['selection']))
 
     def delete(self, goal_id=0):
         if goal_id == 0:
             goal_id = self.settings['selection']
-        if goal_id == 1:
+        if goal_id == 1 or not self._exists(goal_id):
             return
         self._delete(goal_id)
         self.select(1)
         self.hold_select()
 
     def _delete(self, goal_id):
-        self.goals[goal_id] = None
-        self.closed.add(goal_id)
-        next_to_remove = self.edges.pop(goal_id, {})
-        for key, values in self.edges.items():
-            self.edges[key] = [v for v in values if v != goal_id]
-        for next_goal in next_to_remove:
-            other_edges = set(e for es in self.edges.values() for e in es)
-            if next_goal not in other_edges:
-                self._delete(next_goal)
-        self.events.append(('delete', goal_id))
+        # children are deleted before their parents, in the same order
+        # as a depth-first walk would do, but without using recursion
+        stack = [(goal_id, iter(self._detach(goal_id)))]
+        while stack:
+            goal, children = stack[-1]
+            for child in children:
+                self._unlink(goal, child)
+                if not self._parents_of(child):
+                    stack.append((child, iter(self._detach(child))))
+                    break
+            else:
+                stack.pop()
+                self._drop(goal)
+                self.events.append(('delete', goal))
+
+    def _detach(self, goal_id):
+        # links to children are removed by _delete when it gets to them
+        self._invalidate_around(goal_id)
+        self.revision += 1
+        if self._is_open(goal_id):
+            self._count_open_child(goal_id, -1)
+        self._top.discard(goal_id)
+        for parent in list(self._parents_of(goal_id)):
+            self._unlink(parent, goal_id)
+        return list(self._children_of(goal_id))
 
     def toggle_link(self, lower=0, upper=0):
         if lower == 0:
             lower = self.settings['previous_selection']
         if upper == 0:
             upper = self.settings['selection']
-        if lower == upper:
+        if lower == upper or not self._exists(lower) or not self._exists(upper):
             return
-        if upper in self.edges[lower]:
+        parents, upper_open = self._parents_of(upper), self._is_open(upper)
+        if lower in parents:
             # remove existing link unless it's the last one
-            edges_to_upper = sum(1 for g in self.goals
-                                 if g in self.edges and upper in self.edges[g])
-            if edges_to_upper > 1:
-                self.edges[lower].remove(upper)
+            if len(parents) > 1:
+                self._unlink(lower, upper)
+                self._invalidate(lower, upper)
+                if upper_open:
+                    self._open_children[lower] -= 1
+                    self._update_top(lower)
+                self.revision += 1
                 self.events.append(('unlink', lower, upper))
         else:
             # create a new link unless it breaks validity
-            if lower in self.closed and upper not in self.closed:
+            if upper_open and not self._is_open(lower):
                 return
-            front, visited, total = {upper}, set(), set()
-            while front:
-                g = front.pop()
-                visited.add(g)
-                for e in self.edges[g]:
-                    total.add(e)
-                    if e not in visited:
-                        front.add(e)
-            if lower not in total:
-                self.edges[lower].append(upper)
+            if not self._is_reachable(upper, lower):
+                if self._position(lower) > self._position(upper):
+                    self._reorder(lower, upper)
+                self._link(lower, upper)
+                self._invalidate(lower, upper)
+                if upper_open:
+                    self._open_children[lower] += 1
+                    self._update_top(lower)
+                self.revision += 1
                 self.events.append(('link', lower, upper))
 
+    def _is_reachable(self, source, target):
+        # goals are kept in topological order (parents before children), so
+        # only goals placed between source and target have to be visited;
+        # search from both ends to stay inside the smaller of two regions
+        position = self._position
+        lower_bound, upper_bound = position(source), position(target)
+        if lower_bound > upper_bound:
+            return False
+        forward, seen_forward = [source], {source}
+        backward, seen_backward = [target], {target}
+        if source == target:
+            return True
+        while forward and backward:
+            for e in self._children_of(forward.pop()):
+                if e not in seen_forward and position(e) <= upper_bound:
+                    if e in seen_backward:
+                        return True
+                    seen_forward.add(e)
+                    forward.append(e)
+            for p in self._parents_of(backward.pop()):
+                if p not in seen_backward and position(p) >= lower_bound:
+                    if p in seen_forward:
+                        return True
+                    seen_backward.add(p)
+                    backward.append(p)
+        return False
+
+    def _reorder(self, lower, upper):
+        # make room for the new link lower -> upper (Pearce-Kelly algorithm):
+        # ancestors of lower are moved before descendants of upper
+        position = self._position
+        lower_bound, upper_bound = position(upper), position(lower)
+        forward = self._collect(upper, self._children_of, lambda g: position(g) < upper_bound)
+        backward = self._collect(lower, self._parents_of, lambda g: position(g) > lower_bound)
+        affected = sorted(backward, key=position) + sorted(forward, key=position)
+        positions = sorted(position(g) for g in affected)
+        for goal, new_position in zip(affected, positions):
+            self._set_position(goal, new_position)
+
+    @staticmethod
+    def _collect(start, links, in_range):
+        front, visited = [start], {start}
+        while front:
+            goal = front.pop()
+            for g in links(goal):
+                if g not in visited and in_range(g):
+                    visited.add(g)
+                    front.append(g)
+        return visited
+
     def verify(self):
-        assert all(g in self.closed for p in self.closed for g in self.edges.get(p, [])), \
+        goal_ids = range(1, self._next_id)
+        assert not any(self._is_open(g) for p in goal_ids if not self._is_open(p)
+                       for g in self._children_of(p)), \
             'Open goals could not be blocked by closed ones'
 
         queue, visited = [1], set()
         while queue:
             goal = queue.pop()
-            queue.extend(g for g in self.edges[goal]
-                         if g not in visited and self.goals[g] is not None)
+            queue.extend(g for g in self._children_of(goal)
+                         if g not in visited and self._exists(g))
             visited.add(goal)
-        assert visited == set(x for x in self.goals if self.goals[x] is not None), \
+        assert visited == set(g for g in goal_ids if self._exists(g)), \
             'All subgoals must be accessible from the root goal'
 
-        deleted_nodes = [g for g, v in self.goals.items() if v is None]
-        assert all(not self.edges.get(n) for n in deleted_nodes), \
+        assert not any(self._children_of(g) for g in goal_ids if not self._exists(g)), \
             'Deleted goals must have no dependencies'
 
+        assert all(p in self._parents_of(c) for p in goal_ids for c in self._children_of(p)) and \
+            sum(len(self._parents_of(g)) for g in goal_ids) == sum(len(self._children_of(g)) for g in goal_ids), \
+            'Parents index must match the edges'
+
+        # positions start from 1, so goals left out by a cycle keep 0
+        assert all(self._position(g) for g in visited) and \
+            all(self._position(p) < self._position(c) for p in visited for c in self._children_of(p) if c in visited), \
+            'Goals must not form a cycle'
+
+        assert self._top == {g for g in visited if self._is_open(g) and
+                             not any(self._is_open(c) for c in self._children_of(g))}, \
+            'Top goals index must match the goals'
+
         assert all(k in self.settings for k in {'selection', 'previous_selection'})
 
         return True
 
+    def _finish_build(self, settings, verify):
+        # storage is filled by build of a subclass, indexes are made here
+        self.settings.update(settings)
+        self._build_order()
+        self._build_top()
+        if verify:
+            self.verify()
+        return self
+
+
+class Goals(BaseGoals):                                 # pylint: disable=too-many-instance-attributes
+    def __init__(self, name):
+        self.goals = {}
+        self.edges = {}
+        self.parents = {}
+        self.closed = set()
+        self._order = {}
+        self._cache = {}
+        self._open_children = {}
+        self._next_id = 1
+        super().__init__(name)
+
+    def _exists(self, goal_id):
+        return self.goals.get(goal_id) is not None
+
+    def _is_open(self, goal_id):
+        return goal_id not in self.closed
+
+    def _children_of(self, goal_id):
+        return self.edges.get(goal_id, ())
+
+    def _parents_of(self, goal_id):
+        return self.parents.get(goal_id, ())
+
+    def _position(self, goal_id):
+        return self._order.get(goal_id, 0)
+
+    def _set_position(self, goal_id, position):
+        self._order[goal_id] = position
+
+    def _link(self, lower, upper):
+        self.edges[lower].append(upper)
+        self.parents[upper].add(lower)
+
+    def _unlink(self, lower, upper):
+        self.edges[lower].remove(upper)
+        self.parents[upper].remove(lower)
+
+    def _new_goal(self, name):
+        next_id = self._next_id
+        self._next_id += 1
+        self.goals[next_id] = name
+        self.edges[next_id] = list()
+        self.parents[next_id] = set()
+        self._order[next_id] = next_id
+        self._open_children[next_id] = 0
+        return next_id
+
+    def _set_open(self, goal_id, is_open):
+        if is_open:
+            self.closed.discard(goal_id)
+        else:
+            self.closed.add(goal_id)
+
+    def _drop(self, goal_id):
+        self.goals[goal_id] = None
+        self.closed.add(goal_id)
+        self._order.pop(goal_id, None)
+        self._open_children.pop(goal_id, None)
+        self.edges.pop(goal_id, None)
+        self.parents.pop(goal_id, None)
+
+    def select(self, goal_id):
+        if goal_id in self.goals and self.goals[goal_id] is not None:
+            self._invalidate(self.settings['selection'], goal_id)
+            self.settings['selection'] = goal_id
+            self.events.append(('select', goal_id))
+
+    def hold_select(self):
+        self._invalidate(self.settings['previous_selection'], self.settings['selection'])
+        self.settings['previous_selection'] = self.settings['selection']
+        self.events.append(('hold_select', self.settings['selection']))
+
+    def all(self, keys='name', ids=None):
+        # ids may restrict the result to a few goals without visiting others
+        keys = [k for k in ('edge', 'name', 'open', 'select', 'switchable') if k in keys.split(',')]
+        copy_edges = 'edge' in keys
+        result = dict()
+        goals = self.goals.items() if ids is None else ((g, self.goals.get(g)) for g in sorted(ids))
+        for key, name in goals:
+            if name is None:
+                continue
+            value = self._cache.get(key)
+            if value is None:
+                value = self._cache[key] = self._attributes(key, name)
+            result[key] = {k: value[k] for k in keys}
+            if copy_edges:
+                result[key]['edge'] = list(value['edge'])
+        return result
+
+    def _attributes(self, key, name):
+        def sel(x):
+            if x == self.settings['selection']:
+                return 'select'
+            elif x == self.settings['previous_selection']:
+                return 'prev'
+            return None
+        back_references = self.parents[key]
+        switchable = (
+            (key not in self.closed and
+             all(x in self.closed for x in self.edges[key])) or
+            (key in self.closed and (not back_references or
+                                     any(x for x in back_references if x not in self.closed))))
+        return {
+            'edge': sorted(self.edges[key]),
+            'name': name,
+            'open': key not in self.closed,
+            'select': sel(key),
+            'switchable': switchable,
+        }
+
+    def _invalidate(self, *goal_ids):
+        for goal_id in goal_ids:
+            self._cache.pop(goal_id, None)
+
+    def rename(self, new_name, goal_id=0):
+        if goal_id == 0:
+            goal_id = self.settings['selection']
+        self.goals[goal_id] = new_name
+        self._invalidate(goal_id)
+        self.events.append(('rename', new_name, goal_id))
+
+    def _build_order(self):
+        in_degree = {g: len(self.parents[g]) for g in self.goals if self.goals[g] is not None}
+        queue = collections.deque(g for g, d in in_degree.items() if d == 0)
+        self._order = {}
+        while queue:
+            goal = queue.popleft()
+            self._order[goal] = len(self._order) + 1
+            for child in self.edges[goal]:
+                in_degree[child] = in_degree.get(child, 0) - 1
+                if in_degree[child] == 0:
+                    queue.append(child)
+
+    def _build_top(self):
+        self._open_children = {g: sum(1 for c in self.edges[g] if c not in self.closed)
+                               for g in self.goals if self.goals[g] is not None}
+        self._top = {g for g, n in self._open_children.items() if n == 0 and g not in self.closed}
+
     @staticmethod
-    def build(goals, edges, settings):
+    def build(goals, edges, settings, verify=True):
+        # every argument is iterated only once, so cursors may be passed as is
         result = Goals('')
         result.events.clear()  # remove initial goal
-        goals_dict = dict((g[0], g[1]) for g in goals)
-        result.goals = dict((i, goals_dict.get(i))
-                            for i in range(1, max(goals_dict.keys()) + 1))
-        result.closed = set(g[0] for g in goals if not g[2]).union(
-            set(k for k, v in result.goals.items() if v is None))
-        d = collections.defaultdict(list)
+        goals_dict, closed, next_id = {}, set(), 1
+        for goal_id, name, is_open in goals:
+            if goal_id > next_id:
+                goals_dict.update((g, None) for g in range(next_id, goal_id))
+                closed.update(range(next_id, goal_id))
+            goals_dict[goal_id] = name
+            if is_open and name is not None:
+                closed.discard(goal_id)
+            else:
+                closed.add(goal_id)
+            if goal_id >= next_id:
+                next_id = goal_id + 1
+        result.goals, result.closed, result._next_id = goals_dict, closed, next_id
+        result.edges = dict((g, []) for g in goals_dict)
+        result.parents = dict((g, set()) for g in goals_dict)
         for parent, child in edges:
-            d[parent].append(child)
-        result.edges = dict(d)
-        result.edges.update(dict((g, []) for g in result.goals if g not in d))
-        result.settings.update(settings)
-        result.verify()
-        return result
+            result.edges.setdefault(parent, []).append(child)
+            result.parents.setdefault(child, set()).add(parent)
+        return result._finish_build(settings, verify)          # pylint: disable=protected-access
 
     @staticmethod
     def export(goals):
-        nodes = [(g_id, g_name, g_id not in goals.closed)
-                 for g_id, g_name in goals.goals.items()]
+        nodes = [(g_id, goals.goals.get(g_id), g_id not in goals.closed)
+                 for g_id in range(1, goals._next_id)]          # pylint: disable=protected-access
         edges = [(parent, child) for parent in goals.edges
                  for child in goals.edges[parent]]
         settings = list(goals.settings.items())
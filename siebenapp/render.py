@@ -1,40 +1,170 @@
+from bisect import bisect_left, insort
 from collections import defaultdict
+from heapq import heappush, heappop
 
 
-def render_tree(goals):
+def render_tree(goals, sweeps=0):
+    return update_tree(goals, sweeps=sweeps)[0]
+
+
+def update_tree(goals, previous=None, sweeps=0, width=4):
+    # previous is a graph returned by the last call; its layout is reused
+    # as long as the structure of goals allows and rows fit into width,
+    # and the diff shows which goals have to be moved, added or removed
     graph = goals.all(keys='name,edge,open,select,switchable')
     edges = {key: values['edge'] for key, values in graph.items()}
-    layers = min_width(edges, 4)
-    for row in sorted(layers.keys()):
-        for col, goal_id in enumerate(layers[row]):
-            graph[goal_id].update({
-                'row': row,
-                'col': col,
-            })
-    return graph
-
-
-def min_width(source, width):
-    unsorted_goals, sorted_goals, goals_on_previous_layers = dict(source), set(), set()
+    positions = None
+    if previous is None:
+        previous = {}
+    elif previous.keys() == graph.keys() and all(previous[g]['edge'] == edges[g] for g in graph):
+        positions = {g: (previous[g]['row'], previous[g]['col']) for g in graph}
+    else:
+        positions = relayout(edges, previous)
+        changed = [g for g, position in positions.items()
+                   if g not in previous or (previous[g]['row'], previous[g]['col']) != position]
+        if len(changed) * 2 > len(graph) or any(col >= width for _, col in positions.values()):
+            positions = None
+    if positions is None:
+        layers = min_width(edges, width)
+        if sweeps:
+            layers = minimize_crossings(edges, layers, sweeps)
+        positions = {g: (row, col) for row, goals in layers.items() for col, g in enumerate(goals)}
+    for goal_id, (row, col) in positions.items():
+        graph[goal_id].update({
+            'row': row,
+            'col': col,
+        })
+    diff = {
+        'moved': {g for g in graph if g in previous and
+                  (previous[g]['row'], previous[g]['col']) != positions[g]},
+        'added': {g for g in graph if g not in previous},
+        'removed': {g for g in previous if g not in graph},
+    }
+    return graph, diff
+
+
+def relayout(edges, previous):
+    # goals keep their places unless they are new or have to go above one
+    # of their edges; such goals are placed after the last goal of a proper
+    # layer, and places of removed goals are left empty
+    positions = {g: (previous[g]['row'], previous[g]['col']) for g in previous if g in edges}
+    next_col = defaultdict(int)
+    for row, col in positions.values():
+        next_col[row] = max(next_col[row], col + 1)
+    back_edges, waiting = defaultdict(list), {}
+    for goal, targets in edges.items():
+        waiting[goal] = len(targets)
+        for target in targets:
+            back_edges[target].append(goal)
+    ready = [g for g, n in waiting.items() if n == 0]
+    while ready:
+        goal = ready.pop()
+        row = max((positions[t][0] + 1 for t in edges[goal]), default=0)
+        if goal not in positions or positions[goal][0] < row:
+            positions[goal] = row, next_col[row]
+            next_col[row] += 1
+        for parent in back_edges[goal]:
+            waiting[parent] -= 1
+            if waiting[parent] == 0:
+                ready.append(parent)
+    return positions
+
+
+def min_width(source, width):                           # pylint: disable=too-many-locals
+    # goals become candidates once all their edges lead to previous layers;
+    # the one with most edges (the earliest in source on a tie) goes first
+    position = {goal: i for i, goal in enumerate(source)}
+    waiting, back_edges, dependants = {}, defaultdict(int), defaultdict(list)
+    candidates = []
+    for goal, edges in source.items():
+        waiting[goal] = len(edges)
+        for v in edges:
+            dependants[v].append(goal)
+        for v in set(edges):
+            back_edges[v] += 1
+        if not edges:
+            heappush(candidates, (0, position[goal], goal))
     layers = defaultdict(list)
     current_layer, width_current, width_up = 0, 0, 0
-    while unsorted_goals:
-        candidates = [(goal, len(edges)) for goal, edges in unsorted_goals.items()
-                      if all(v in goals_on_previous_layers for v in edges)]
-        best_candidates = sorted(candidates, key=lambda x: x[1], reverse=True)
-        edges = 0
-        if best_candidates:
-            goal, edges = best_candidates[0]
-            unsorted_goals.pop(goal)
-            sorted_goals.add(goal)
+    placed, unsorted_count = [], len(source)
+    while unsorted_count:
+        edges, found = 0, bool(candidates)
+        if found:
+            edges, _, goal = heappop(candidates)
+            edges = -edges
+            unsorted_count -= 1
+            placed.append(goal)
             layers[current_layer].append(goal)
-            back_edges = len([k for k, vs in source.items() if goal in vs])
             width_current += 1 - edges
-            width_up += back_edges
+            width_up += back_edges[goal]
         # pylint: disable=consider-using-ternary
         must_go_up = (width_current >= width and edges < 1) or (width_up >= width)
-        if not best_candidates or must_go_up:
+        if not found or must_go_up:
+            if not found and not placed:
+                break  # remaining goals depend on missing ones
             current_layer += 1
-            goals_on_previous_layers.update(sorted_goals)
+            for goal in placed:
+                for dependant in dependants[goal]:
+                    waiting[dependant] -= 1
+                    if waiting[dependant] == 0:
+                        heappush(candidates, (-len(source[dependant]), position[dependant], dependant))
+            placed = []
             width_current, width_up = width_up, 0
     return dict(layers)
+
+
+def minimize_crossings(edges, layers, sweeps=4):        # pylint: disable=too-many-locals
+    # barycenter heuristic: goals on every layer are ordered by the average
+    # position of their neighbours, downwards by edges and upwards by back edges
+    back_edges = defaultdict(list)
+    for goal, targets in edges.items():
+        for target in targets:
+            back_edges[target].append(goal)
+    current = {row: list(goals) for row, goals in layers.items()}
+    position = {g: i for goals in current.values() for i, g in enumerate(goals)}
+    rows = sorted(current)
+    best, best_crossings = layers, count_crossings(edges, layers)
+    for _ in range(sweeps):
+        if not best_crossings:
+            break
+        for order, neighbours in ((rows[1:], edges), (rows[-2::-1], back_edges)):
+            for row in order:
+                barycenter = {}
+                for goal in current[row]:
+                    linked = [position[g] for g in neighbours.get(goal, []) if g in position]
+                    barycenter[goal] = sum(linked) / len(linked) if linked else position[goal]
+                current[row].sort(key=barycenter.get)
+                position.update((g, i) for i, g in enumerate(current[row]))
+        crossings = count_crossings(edges, current)
+        if crossings >= best_crossings:
+            break
+        best = {row: list(goals) for row, goals in current.items()}
+        best_crossings = crossings
+    return best
+
+
+def count_crossings(edges, layers):
+    # edges spanning several layers are straight lines, so their positions
+    # between the end points are interpolated
+    placement = {g: (row, col) for row, goals in layers.items() for col, g in enumerate(goals)}
+    bands = defaultdict(list)
+    for goal, targets in edges.items():
+        for target in targets:
+            if goal not in placement or target not in placement:
+                continue
+            (low_row, low_col), (high_row, high_col) = sorted([placement[goal], placement[target]])
+            span = high_row - low_row
+            for row in range(low_row, high_row):
+                bands[row].append((
+                    low_col + (high_col - low_col) * (row - low_row) / span,
+                    low_col + (high_col - low_col) * (row + 1 - low_row) / span,
+                ))
+    return sum(_count_inversions([x for _, x in sorted(band)]) for band in bands.values())
+
+
+def _count_inversions(values):
+    seen, count = [], 0
+    for value in reversed(values):
+        count += bisect_left(seen, value)
+        insort(seen, value)
+    return count
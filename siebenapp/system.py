@@ -1,7 +1,18 @@
 # coding: utf-8
+import collections
+import hashlib
+import io
+import mmap
 import sqlite3
+import struct
+import sys
+import threading
+from array import array
+from contextlib import closing
 from html import escape
 from os import path
+from subprocess import run, PIPE
+from timeit import default_timer
 from siebenapp.goaltree import Goals
 from siebenapp.enumeration import Enumeration
 from siebenapp.zoom import Zoom
@@ -59,72 +70,318 @@ MIGRATIONS = [
     [
         'alter table selection rename to settings',
     ],
+    # 4
+    [
+        # add primary key and index to edges
+        '''alter table edges rename to old_edges''',
+        '''create table edges (
+            parent integer,
+            child integer,
+            primary key(parent, child),
+            foreign key(parent) references goals(goal_id),
+            foreign key(child) references goals(goal_id)
+        )''',
+        '''insert or ignore into edges (parent, child)
+           select parent, child from old_edges''',
+        '''drop table old_edges''',
+        '''create index edges_child on edges (child)''',
+        # make settings.name unique, the last written value wins
+        '''alter table settings rename to old_settings''',
+        '''create table settings (
+            name text primary key,
+            goal integer,
+            foreign key(goal) references goals(goal_id)
+        )''',
+        '''insert or replace into settings (name, goal)
+           select name, goal from old_settings order by rowid''',
+        '''drop table old_settings''',
+    ],
 ]
 
 
+class Storage:                                          # pylint: disable=too-many-instance-attributes
+    def __init__(self, filename=DEFAULT_DB, flush_events=1, flush_interval=None):
+        self.flush_events = flush_events
+        self.flush_interval = flush_interval
+        self.is_new = not path.isfile(filename)
+        if not self.is_new and is_snapshot(filename):
+            raise ValueError('%s is a read-only snapshot, changes could not be saved into it' % filename)
+        # changes may be written from a background thread, see take() and write()
+        self.connection = sqlite3.connect(filename, check_same_thread=False)
+        run_migrations(self.connection)
+        self.exported = None
+        self.pending = collections.deque()
+        self.lock = threading.Lock()
+        self.last_flush = default_timer()
+
+    def save(self, goals):
+        return self.flush() if self.collect(goals) else 0
+
+    def collect(self, goals):
+        with self.lock:
+            if self.is_new:
+                self.exported = Goals.export(goals)
+                self.is_new = False
+            else:
+                self.pending.extend(goals.events)
+            goals.events.clear()
+            elapsed = (default_timer() - self.last_flush) * 1000
+            return self.exported is not None or len(self.pending) >= self.flush_events or \
+                (self.flush_interval is not None and elapsed >= self.flush_interval)
+
+    def take(self):
+        with self.lock:
+            batch = self.exported, self.pending
+            self.exported, self.pending = None, collections.deque()
+            self.last_flush = default_timer()
+            return batch
+
+    def restore(self, batch):
+        # a batch which could not be written goes before newer changes
+        exported, events = batch
+        with self.lock:
+            if exported is not None:
+                self.exported = exported
+            events.extend(self.pending)
+            self.pending = events
+
+    def write(self, batch):
+        # the whole batch is written in one transaction; if it fails,
+        # the batch is restored to be written with the next one
+        exported, events = batch
+        written = 0
+        try:
+            if exported is not None:
+                goals_export, edges_export, select_export = exported
+                cur = self.connection.cursor()
+                cur.executemany('insert into goals values (?,?,?)', goals_export)
+                cur.executemany('insert into edges values (?,?)', edges_export)
+                cur.executemany('insert into settings values (?,?)', select_export)
+                written = len(goals_export) + len(edges_export) + len(select_export)
+            if events:
+                compacted = collections.deque(events)
+                compact_events(compacted)
+                written += write_events(compacted, self.connection)
+            self.connection.commit()
+        except sqlite3.Error:
+            self.connection.rollback()
+            self.restore(batch)
+            raise
+        return written
+
+    def flush(self):
+        return self.write(self.take())
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+
 def save(goals, filename=DEFAULT_DB):
-    if path.isfile(filename):
-        connection = sqlite3.connect(filename)
-        run_migrations(connection)
-        save_updates(goals, connection)
-        connection.close()
-    else:
-        connection = sqlite3.connect(filename)
-        run_migrations(connection)
-        goals_export, edges_export, select_export = Goals.export(goals)
-        cur = connection.cursor()
-        cur.executemany('insert into goals values (?,?,?)', goals_export)
-        cur.executemany('insert into edges values (?,?)', edges_export)
-        cur.executemany('insert into settings values (?,?)', select_export)
-        goals.events.clear()
-        connection.commit()
-        connection.close()
+    with closing(Storage(filename)) as storage:
+        return storage.save(goals)
 
 
 def save_updates(goals, connection):
-    actions = {
-        'add': ['insert into goals values (?,?,?)'],
-        'toggle_close': ['update goals set open=? where goal_id=?'],
-        'rename': ['update goals set name=? where goal_id=?'],
-        'link': ['insert into edges values (?,?)'],
-        'unlink': ['delete from edges where parent=? and child=?'],
-        'select': ['delete from settings where name="selection"',
-                   'insert into settings values ("selection", ?)'],
-        'hold_select': ['delete from settings where name="previous_selection"',
-                        'insert into settings values ("previous_selection", ?)'],
-        'delete': ['delete from goals where goal_id=?',
-                   'delete from edges where child=?',
-                   'delete from edges where parent=?'],
-        'zoom': ['delete from settings where name="zoom"',
-                 'insert into settings values ("zoom", ?)'],
-    }
+    compact_events(goals.events)
+    return write_events(goals.events, connection)
+
+
+def compact_events(events):                             # pylint: disable=too-many-branches
+    added = set(e[1] for e in events if e[0] == 'add')
+    deleted = set(e[1] for e in events if e[0] == 'delete')
+    # keep only the last write for every setting and every goal attribute;
+    # goal ids are never reused, so anything before a delete is irrelevant
+    superseded, result = set(), []
+    for event in reversed(events):
+        if event[0] in ('select', 'hold_select', 'zoom'):
+            key = event[0]
+        elif event[0] in ('rename', 'toggle_close'):
+            key = event[0], event[2]
+            if event[2] in deleted:
+                continue
+        elif event[0] in ('link', 'unlink'):
+            key = None
+            if event[1] in deleted or event[2] in deleted:
+                continue
+        else:
+            key = None
+            if event[1] in added and event[1] in deleted:
+                continue
+        if key in superseded:
+            continue
+        if key is not None:
+            superseded.add(key)
+        result.append(event)
+    # link followed by unlink of the same goals (or vice versa) cancel out
+    compacted, last_link = [], {}
+    for event in reversed(result):
+        if event[0] in ('link', 'unlink'):
+            previous = last_link.pop(event[1:], None)
+            if previous is not None and compacted[previous][0] != event[0]:
+                compacted[previous] = None
+                continue
+            last_link[event[1:]] = len(compacted)
+        compacted.append(event)
+    events.clear()
+    events.extend(e for e in compacted if e is not None)
+
+
+ACTIONS = [
+    ('add', ['insert into goals values (?,?,?)']),
+    ('rename', ['update goals set name=? where goal_id=?']),
+    ('toggle_close', ['update goals set open=? where goal_id=?']),
+    ('link', ['insert into edges values (?,?)']),
+    ('unlink', ['delete from edges where parent=? and child=?']),
+    ('delete', ['delete from goals where goal_id=?',
+                'delete from edges where child=?',
+                'delete from edges where parent=?']),
+    ('select', ['insert or replace into settings values ("selection", ?)']),
+    ('hold_select', ['insert or replace into settings values ("previous_selection", ?)']),
+    ('zoom', ['insert or replace into settings values ("zoom", ?)']),
+]
+TOUCHED_GOALS = {
+    'add': slice(1, 2),
+    'rename': slice(2, 3),
+    'toggle_close': slice(2, 3),
+    'link': slice(1, 3),
+    'unlink': slice(1, 3),
+    'delete': slice(1, 2),
+    'select': slice(0, 0),
+    'hold_select': slice(0, 0),
+    'zoom': slice(0, 0),
+}
+
+
+def write_events(events, connection):
     cur = connection.cursor()
-    while goals.events:
-        event = goals.events.popleft()
-        if event[0] in actions:
-            for query in actions[event[0]]:
-                if '?' in query:
-                    cur.execute(query, event[1:])
-                else:
-                    cur.execute(query)
+    written = 0
+    while events:
+        batches = _take_batches(events)
+        for name, queries in ACTIONS:
+            if name not in batches:
+                continue
+            for query in queries:
+                cur.executemany(query, batches[name])
+                written += cur.rowcount
     connection.commit()
+    return written
+
 
+def _take_batches(events):
+    # Events of one kind are written together in the order of ACTIONS.
+    # Events of different kinds touch different rows and may be reordered,
+    # except a link following an unlink of the same goals, and anything
+    # following a delete of its goal: the batch ends before such event.
+    batches, unlinked, deleted = {}, set(), set()
+    while events:
+        event = events.popleft()
+        params = event[1:]
+        if event[0] == 'link' and params in unlinked or \
+                deleted and not deleted.isdisjoint(event[TOUCHED_GOALS.get(event[0], slice(0))]):
+            events.appendleft(event)
+            break
+        if event[0] in batches:
+            batches[event[0]].append(params)
+        elif event[0] in TOUCHED_GOALS:
+            batches[event[0]] = [params]
+        if event[0] == 'unlink':
+            unlinked.add(params)
+        elif event[0] == 'delete':
+            deleted.add(event[1])
+    return batches
 
-def load(filename=DEFAULT_DB):
-    if path.isfile(filename):
-        connection = sqlite3.connect(filename)
-        run_migrations(connection)
-        cur = connection.cursor()
-        goals = [row for row in cur.execute('select * from goals')]
-        edges = [row for row in cur.execute('select * from edges')]
-        settings = [row for row in cur.execute('select * from settings')]
-        cur.close()
-        goals = Goals.build(goals, edges, settings)
+
+def load(filename=DEFAULT_DB, verify=True, goals_class=Goals):
+    # goals_class may be Goals or CompactGoals, they have the same interface
+    if path.isfile(filename) and is_snapshot(filename):
+        goals = load_snapshot(filename, verify, goals_class)
+    elif path.isfile(filename):
+        with closing(sqlite3.connect(filename)) as connection:
+            run_migrations(connection)
+            goals = goals_class.build(connection.execute('select * from goals order by goal_id'),
+                                      connection.execute('select * from edges'),
+                                      connection.execute('select * from settings'),
+                                      verify)
     else:
-        goals = Goals('Rename me')
+        goals = goals_class('Rename me')
     return Enumeration(Zoom(goals))
 
 
+# Snapshot is a read-only alternative to the database: a header followed by
+# flags of every goal id (deleted ones included), offsets of their names,
+# pairs of linked goals, values and names of settings, and UTF-8 names.
+# Numbers are little-endian; ids are implicit and go from 1 without gaps.
+SNAPSHOT_SIGNATURE = b'SIEBEN\x00\x01'
+SNAPSHOT_HEADER = struct.Struct('<8sIIIII')
+GOAL_OPEN, GOAL_PRESENT = 1, 2
+
+
+def is_snapshot(filename):
+    with open(filename, 'rb') as f:
+        return f.read(len(SNAPSHOT_SIGNATURE)) == SNAPSHOT_SIGNATURE
+
+
+def save_snapshot(goals, filename):                     # pylint: disable=too-many-locals
+    nodes, edges, settings = Goals.export(goals)
+    flags = bytearray(len(nodes))
+    offsets, names = array('I', [0]), io.BytesIO()
+    for i, (_, name, is_open) in enumerate(nodes):
+        if name is not None:
+            flags[i] = GOAL_PRESENT | (GOAL_OPEN if is_open else 0)
+            names.write(name.encode('utf-8'))
+        offsets.append(names.tell())
+    links = array('I', (goal for edge in edges for goal in edge))
+    keys = '\n'.join(k for k, _ in settings).encode('utf-8')
+    values = array('q', (v for _, v in settings))
+    with open(filename, 'wb') as f:
+        f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_SIGNATURE, len(nodes), len(edges),
+                                     len(settings), len(keys), names.tell()))
+        f.write(flags)
+        for block in (offsets, links, values):
+            _write_array(block, f)
+        f.write(keys)
+        f.write(names.getbuffer())
+
+
+def load_snapshot(filename, verify=True, goals_class=Goals):  # pylint: disable=too-many-locals
+    with open(filename, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        signature, goals, edges, settings, keys_size, names_size = SNAPSHOT_HEADER.unpack_from(data)
+        if signature != SNAPSHOT_SIGNATURE:
+            raise ValueError('%s is not a snapshot' % filename)
+        position = SNAPSHOT_HEADER.size
+        flags = data[position:position + goals]
+        offsets, position = _read_array('I', data, position + goals, goals + 1)
+        links, position = _read_array('I', data, position, 2 * edges)
+        values, position = _read_array('q', data, position, settings)
+        keys = data[position:position + keys_size].decode('utf-8').split('\n') if settings else []
+        names = position + keys_size
+        if len(data) != names + names_size:
+            raise ValueError('%s is truncated' % filename)
+        nodes = ((i + 1,
+                  data[names + offsets[i]:names + offsets[i + 1]].decode('utf-8')
+                  if flags[i] & GOAL_PRESENT else None,
+                  bool(flags[i] & GOAL_OPEN))
+                 for i in range(goals))
+        return goals_class.build(nodes, zip(links[::2], links[1::2]), zip(keys, values), verify)
+
+
+def _write_array(block, f):
+    if sys.byteorder == 'big':
+        block = array(block.typecode, block)
+        block.byteswap()
+    f.write(block.tobytes())
+
+
+def _read_array(typecode, data, position, count):
+    block = array(typecode)
+    end = position + count * block.itemsize
+    block.frombytes(data[position:end])
+    if sys.byteorder == 'big':
+        block.byteswap()
+    return block, end
+
+
 def run_migrations(conn, migrations=None):
     if migrations is None:
         migrations = MIGRATIONS
@@ -143,13 +400,13 @@ def run_migrations(conn, migrations=None):
 
 def split_long(line):
     margin = 20
-    parts = []
+    parts, start = [], 0
     space_position = line.find(' ', margin)
     while space_position > 0:
-        part, line = line[:space_position], line[(space_position + 1):]
-        parts.append(part)
-        space_position = line.find(' ', margin)
-    parts.append(line)
+        parts.append(line[start:space_position])
+        start = space_position + 1
+        space_position = line.find(' ', start + margin)
+    parts.append(line[start:])
     return '\n'.join(parts)
 
 
@@ -159,36 +416,63 @@ def _format_name(num, goal):
     return split_long(label)
 
 
+FILL_COLORS = {'select': ', fillcolor=gray', 'prev': ', fillcolor=lightgray'}
+
+
 def dot_export(goals):
+    out = io.StringIO()
+    write_dot(goals, out)
+    return out.getvalue()
+
+
+def write_dot(goals, out):
+    # lines are written one by one, so out may be a file or a pipe
     data = goals.all(keys='open,name,edge,select,switchable')
-    lines = []
-    for num in sorted(data.keys()):
+    ordered = sorted(data.keys())
+    out.write('digraph g {\nnode [shape=box];\n')
+    if not ordered:
+        out.write('\n')
+    for num in ordered:
         goal = data[num]
-        style = []
-        if goal['switchable'] and goal['open']:
-            style.append('bold')
-        attributes = {
-            'label': _format_name(num, goal),
-            'color': 'red' if goal['open'] else 'green',
-            'fillcolor': {'select': 'gray', 'prev': 'lightgray'}.get(goal['select']),
-        }
-        if goal['select'] is not None:
-            style.append('filled')
-        if len(style) > 1:
-            attributes['style'] = '"%s"' % ','.join(style)
-        elif len(style) == 1:
-            attributes['style'] = style[0]
-        attributes_str = ', '.join(
-            '%s=%s' % (k, attributes[k])
-            for k in ['label', 'color', 'style', 'fillcolor']
-            if k in attributes and attributes[k]
-        )
-        lines.append('%d [%s];' % (num, attributes_str))
-    for num in sorted(data.keys()):
+        bold = goal['switchable'] and goal['open']
+        if goal['select'] is None:
+            style = ', style=bold' if bold else ''
+        else:
+            style = (', style="bold,filled"' if bold else ', style=filled') + \
+                FILL_COLORS.get(goal['select'], '')
+        out.write('%d [label=%s, color=%s%s];\n' % (
+            num, _format_name(num, goal), 'red' if goal['open'] else 'green', style))
+    for num in ordered:
+        line_attrs = ', style=dashed' if num < 0 else ''
         for edge in data[num]['edge']:
-            color = 'black' if data[edge]['open'] else 'gray'
-            line_attrs = 'color=%s' % color
-            if num < 0:
-                line_attrs += ', style=dashed'
-            lines.append('%d -> %d [%s];' % (edge, num, line_attrs))
-    return 'digraph g {\nnode [shape=box];\n%s\n}' % '\n'.join(lines)
+            out.write('%d -> %d [color=%s%s];\n' % (
+                edge, num, 'black' if data[edge]['open'] else 'gray', line_attrs))
+    out.write('}')
+
+
+def render_png(dot, command=('dot', '-Tpng')):
+    # image is passed through pipes, no temporary files are used
+    return run(list(command), input=dot.encode('utf-8'), stdout=PIPE, check=True).stdout
+
+
+class RenderCache:
+    # recently rendered images, keyed by a hash of their DOT text
+    def __init__(self, size=16):
+        self.size = size
+        self.images = collections.OrderedDict()
+
+    @staticmethod
+    def key(dot):
+        return hashlib.sha1(dot.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        image = self.images.get(key)
+        if image is not None:
+            self.images.move_to_end(key)
+        return image
+
+    def put(self, key, image):
+        self.images[key] = image
+        self.images.move_to_end(key)
+        while len(self.images) > self.size:
+            self.images.popitem(last=False)
@@ -1,14 +1,18 @@
 # coding: utf-8
 import sqlite3
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import closing
 from tempfile import NamedTemporaryFile
 
 import pytest
 
+from siebenapp.compact import CompactGoals
 from siebenapp.enumeration import Enumeration
 from siebenapp.goaltree import Goals
-from siebenapp.system import MIGRATIONS, run_migrations, load, save
+from siebenapp.system import MIGRATIONS, run_migrations, load, save, Storage, write_events, \
+    save_snapshot, load_snapshot, is_snapshot
 from siebenapp.zoom import Zoom
 
 
@@ -37,7 +41,7 @@ def test_last_known_migration():
             run_migrations(conn)
             cur.execute('select version from migrations')
             version = cur.fetchone()[0]
-            assert version == 3
+            assert version == 4
 
 
 def setup_sample_db(conn):
@@ -51,6 +55,23 @@ def setup_sample_db(conn):
         conn.commit()
 
 
+def test_duplicated_edges_and_settings_are_merged_by_migration():
+    with closing(sqlite3.connect(':memory:')) as conn:
+        with closing(conn.cursor()) as cur:
+            run_migrations(conn, MIGRATIONS[:4])
+            cur.executemany('insert into goals values (?,?,?)', [(1, 'Root', True), (2, 'A', True)])
+            cur.executemany('insert into edges values (?,?)', [(1, 2), (1, 2)])
+            cur.executemany('insert into settings values (?,?)',
+                            [('selection', 1), ('previous_selection', 1), ('selection', 2)])
+            conn.commit()
+            run_migrations(conn)
+            assert list(cur.execute('select * from edges')) == [(1, 2)]
+            assert sorted(cur.execute('select * from settings')) == [
+                ('previous_selection', 1), ('selection', 2)]
+            with pytest.raises(sqlite3.IntegrityError):
+                cur.execute('insert into edges values (1, 2)')
+
+
 def test_restore_goals_from_db():
     file_name = NamedTemporaryFile().name
     with sqlite3.connect(file_name) as conn:
@@ -152,3 +173,179 @@ def test_do_not_load_from_broken_data():
             cur.execute('delete from goals where goal_id = 2')
     with pytest.raises(AssertionError):
         load(file_name)
+
+
+def test_verification_of_loaded_data_may_be_deferred():
+    file_name = NamedTemporaryFile().name
+    with sqlite3.connect(file_name) as conn:
+        run_migrations(conn)
+        setup_sample_db(conn)
+        with closing(conn.cursor()) as cur:
+            cur.execute('delete from goals where goal_id = 2')
+    goals = load(file_name, verify=False)
+    with pytest.raises(AssertionError):
+        goals.verify()
+
+
+def test_build_goals_from_iterators():
+    goals = Goals.build(iter([(1, 'Root', True), (2, 'A', True), (4, 'B', False)]),
+                        iter([(1, 2), (2, 4)]),
+                        iter([('selection', 2), ('previous_selection', 1)]))
+    assert goals.all(keys='name,edge,open,select') == {
+        1: {'name': 'Root', 'edge': [2], 'open': True, 'select': 'prev'},
+        2: {'name': 'A', 'edge': [4], 'open': True, 'select': 'select'},
+        4: {'name': 'B', 'edge': [], 'open': False, 'select': None},
+    }
+
+
+def test_save_and_load_snapshot():
+    file_name = NamedTemporaryFile().name
+    goals = Enumeration(Zoom(Goals('Root')))
+    goals.add('Верх')
+    goals.add('Middle\nline')
+    goals.add('Deleted')
+    goals.select(4)
+    goals.delete()
+    goals.add('Closed')
+    goals.select(5)
+    goals.toggle_close()
+    goals.select(3)
+    goals.hold_select()
+    goals.select(2)
+    goals.toggle_link()
+    goals.toggle_zoom()
+    save_snapshot(goals, file_name)
+    assert is_snapshot(file_name)
+    new_goals = load(file_name)
+    assert Goals.export(new_goals.goaltree.goaltree) == Goals.export(goals.goaltree.goaltree)
+    assert goals.all(keys='open,name,edge,select,switchable') == \
+        new_goals.all(keys='open,name,edge,select,switchable')
+
+
+@pytest.mark.parametrize('write', [save, save_snapshot])
+def test_load_into_compact_goals(write):
+    file_name = NamedTemporaryFile().name
+    goals = Goals('Root')
+    goals.add('A')
+    goals.add('B', 2)
+    goals.delete(3)
+    goals.add('C')
+    write(goals, file_name)
+    new_goals = load(file_name, goals_class=CompactGoals)
+    assert isinstance(new_goals.goaltree.goaltree, CompactGoals)
+    assert new_goals.goaltree.goaltree.all(keys='name,edge,open') == goals.all(keys='name,edge,open')
+
+
+def test_snapshot_could_not_be_opened_for_changes():
+    file_name = NamedTemporaryFile().name
+    save_snapshot(Goals('Root'), file_name)
+    goals = load(file_name)
+    with pytest.raises(ValueError, match='snapshot'):
+        Storage(file_name)
+    assert goals.all() == {1: {'name': 'Root'}}
+
+
+def test_sqlite_database_is_not_a_snapshot():
+    file_name = NamedTemporaryFile().name
+    save(Goals('Root'), file_name)
+    assert not is_snapshot(file_name)
+
+
+def test_do_not_load_truncated_snapshot():
+    file_name = NamedTemporaryFile().name
+    save_snapshot(Goals('Root'), file_name)
+    with open(file_name, 'r+b') as f:
+        f.truncate(f.seek(0, 2) - 1)
+    with pytest.raises(ValueError):
+        load_snapshot(file_name)
+
+
+def count_goals(file_name):
+    with closing(sqlite3.connect(file_name)) as conn:
+        with closing(conn.cursor()) as cur:
+            cur.execute('select count(*) from goals')
+            return cur.fetchone()[0]
+
+
+def test_storage_writes_events_in_batches():
+    file_name = NamedTemporaryFile().name
+    goals = Goals('Root')
+    with closing(Storage(file_name, flush_events=4)) as storage:
+        storage.save(goals)
+        assert count_goals(file_name) == 1
+        goals.add('A')
+        storage.save(goals)
+        assert not goals.events
+        assert count_goals(file_name) == 1
+        goals.add('B')
+        storage.save(goals)
+        assert count_goals(file_name) == 3
+        goals.add('C')
+        storage.save(goals)
+        assert count_goals(file_name) == 3
+    assert count_goals(file_name) == 4
+    assert load(file_name).all() == goals.all()
+
+
+def test_storage_writes_events_after_interval():
+    file_name = NamedTemporaryFile().name
+    goals = Goals('Root')
+    with closing(Storage(file_name, flush_events=100, flush_interval=0)) as storage:
+        storage.save(goals)
+        goals.add('A')
+        storage.save(goals)
+        assert count_goals(file_name) == 2
+
+
+def test_storage_keeps_changes_which_could_not_be_written():
+    file_name = NamedTemporaryFile().name
+    goals = Goals('Root')
+    with closing(Storage(file_name)) as storage:
+        storage.save(goals)
+        goals.add('A')
+        goals.add('B')
+        storage.collect(goals)
+        batch = storage.take()
+        storage.connection.execute('alter table goals rename to hidden_goals')
+        with pytest.raises(sqlite3.OperationalError):
+            storage.write(batch)
+        storage.connection.execute('alter table hidden_goals rename to goals')
+        assert count_goals(file_name) == 1
+        goals.add('C')
+        storage.save(goals)
+    assert load(file_name).all() == goals.all()
+
+
+def test_storage_changes_may_be_written_in_another_thread():
+    file_name = NamedTemporaryFile().name
+    goals = Goals('Root')
+    with ThreadPoolExecutor(max_workers=1) as worker, \
+            closing(Storage(file_name, flush_events=3)) as storage:
+        assert storage.collect(goals)
+        assert worker.submit(storage.write, storage.take()).result() == 3
+        goals.add('A')
+        assert not storage.collect(goals)
+        goals.add('B')
+        assert storage.collect(goals)
+        batch = storage.take()
+        assert not storage.pending
+        worker.submit(storage.write, batch).result()
+        assert count_goals(file_name) == 3
+    assert load(file_name).all() == goals.all()
+
+
+def test_write_events_keeps_order_of_dependent_events():
+    with closing(sqlite3.connect(':memory:')) as conn:
+        run_migrations(conn)
+        events = deque([('add', 1, 'Root', True), ('add', 2, 'A', True), ('link', 1, 2),
+                        ('add', 3, 'B', True), ('link', 1, 3), ('delete', 2),
+                        ('add', 4, 'C', True), ('link', 3, 4), ('unlink', 1, 3),
+                        ('link', 1, 3), ('select', 3), ('select', 4)])
+        written = write_events(events, conn)
+        assert not events
+        with closing(conn.cursor()) as cur:
+            assert list(cur.execute('select goal_id from goals order by goal_id')) == [(1,), (3,), (4,)]
+            assert sorted(cur.execute('select * from edges')) == [(1, 3), (3, 4)]
+            assert list(cur.execute('select * from settings')) == [('selection', 4)]
+        # 4 goals, 4 links, 1 unlink, 1 goal and 1 edge deleted, 2 settings
+        assert written == 13
@@ -1,5 +1,6 @@
 from siebenapp.enumeration import Enumeration
 from siebenapp.goaltree import Goals
+from siebenapp.zoom import Zoom
 
 
 def test_simple_enumeration_is_not_changed():
@@ -313,9 +314,10 @@ def test_simple_open_enumeration_workflow():
 
 
 class PseudoZoomedGoals(Goals):
-    def all(self, keys='name'):
-        goals = super(PseudoZoomedGoals, self).all(keys)
-        goals[-1] = goals.pop(1)
+    def all(self, keys='name', ids=None):
+        goals = super(PseudoZoomedGoals, self).all(keys, ids)
+        if 1 in goals:
+            goals[-1] = goals.pop(1)
         return goals
 
 
@@ -336,3 +338,77 @@ def test_do_not_enumerate_goals_with_negative_id():
         1: {'name': 'Zoomed', 'select': 'select', 'edge': [2]},
         2: {'name': 'Top', 'select': None, 'edge': []},
     }
+
+
+def count_traversals(goals):
+    # arguments of every goals.all() call are collected into the returned list
+    calls = []
+    original_all = goals.all
+
+    def counting_all(keys='name', ids=None):
+        calls.append((keys, ids))
+        return original_all(keys, ids)
+    goals.all = counting_all
+    return calls
+
+
+def test_all_goals_are_traversed_once_per_request():
+    g = Goals('Root')
+    g.add('Zoomed')
+    g.add('Top', 2)
+    g.add('Other top')
+    g.select(2)
+    z = Zoom(g)
+    z.toggle_zoom()
+    e = Enumeration(z)
+    e.next_view()
+    calls = count_traversals(g)
+    assert e.all('name,select,edge') == {
+        1: {'name': 'Top', 'select': 'select', 'edge': []},
+    }
+    assert len(calls) == 1
+    e.next_view()
+    calls.clear()
+    assert e.all('name,select,edge') == {
+        -1: {'name': 'Root', 'select': None, 'edge': [1]},
+        1: {'name': 'Zoomed', 'select': None, 'edge': [2]},
+        2: {'name': 'Top', 'select': 'select', 'edge': []},
+    }
+    assert len(calls) == 1
+    e.select(2)
+    assert len(calls) == 1
+
+
+def test_selection_does_not_traverse_goals_until_they_are_changed():
+    g = Goals('Root')
+    for c in 'bcdefghijk':
+        g.add(c)
+    e = Enumeration(g)
+    calls = count_traversals(g)
+    e.select(1)
+    e.select(3)
+    e.select(2)
+    e.select(1)
+    assert calls == []
+    assert e.settings['selection'] == 11
+    e.hold_select()
+    e.toggle_close()
+    e.select(1)
+    assert len(calls) == 1
+    e.select(2)
+    assert len(calls) == 1
+    assert e.settings['selection'] == 2
+
+
+def test_top_view_is_built_without_traversing_goals():
+    g = Goals('Root')
+    g.add('Top 1')
+    g.add('Top 2')
+    e = Enumeration(g)
+    calls = count_traversals(g)
+    e.next_view()
+    e.select(2)
+    assert calls == []
+    assert e.settings['selection'] == 3
+    assert e.all() == {1: {'name': 'Top 1'}, 2: {'name': 'Top 2'}}
+    assert calls == [('name', {2, 3})]
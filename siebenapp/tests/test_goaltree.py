@@ -1,12 +1,18 @@
 # coding: utf-8
+import random
 from unittest import TestCase
 
+from siebenapp.compact import CompactGoals
+from siebenapp.enumeration import Enumeration
 from siebenapp.goaltree import Goals
+from siebenapp.zoom import Zoom
 
 
 class GoalsTest(TestCase):
+    goals_class = Goals
+
     def setUp(self):
-        self.goals = Goals('Root')
+        self.goals = self.goals_class('Root')
 
     def test_there_is_one_goal_at_start(self):
         assert self.goals.all(keys='name,switchable') == {
@@ -372,3 +378,137 @@ class GoalsTest(TestCase):
         assert self.goals.events[-1] == ('link', 2, 3)
         self.goals.toggle_link()
         assert self.goals.events[-1] == ('unlink', 2, 3)
+
+    def test_parents_index_follows_changes(self):
+        self.goals.add('A')
+        self.goals.add('B')
+        self.goals.add('C', 2)
+        self.goals.toggle_link(3, 4)
+        assert self.goals.parents == {1: set(), 2: {1}, 3: {1}, 4: {2, 3}}
+        self.goals.toggle_link(3, 4)
+        assert self.goals.parents == {1: set(), 2: {1}, 3: {1}, 4: {2}}
+        self.goals.delete(2)
+        assert self.goals.parents == {1: set(), 3: {1}}
+
+    def test_changes_in_returned_values_do_not_affect_goals(self):
+        self.goals.add('A')
+        result = self.goals.all(keys='name,edge')
+        result[1]['edge'].append(42)
+        result[2]['name'] = 'Changed'
+        assert self.goals.all(keys='name,edge') == {
+            1: {'name': 'Root', 'edge': [2]},
+            2: {'name': 'A', 'edge': []}}
+
+    def test_ids_of_deleted_goals_are_not_reused(self):
+        self.goals.add('A')
+        self.goals.add('B')
+        self.goals.delete(3)
+        self.goals.add('C')
+        assert self.goals.all() == {1: {'name': 'Root'}, 2: {'name': 'A'}, 4: {'name': 'C'}}
+
+    def test_id_counter_survives_export_and_build(self):
+        self.goals.add('A')
+        self.goals.add('B')
+        self.goals.delete(3)
+        restored = self.goals_class.build(*self.goals_class.export(self.goals))
+        restored.add('C')
+        assert restored.all() == {1: {'name': 'Root'}, 2: {'name': 'A'}, 4: {'name': 'C'}}
+
+    def test_delete_long_chain_of_goals(self):
+        for i in range(5000):
+            self.goals.add(str(i), i + 1)
+        self.goals.delete(2)
+        assert self.goals.all() == {1: {'name': 'Root'}}
+        assert self.goals.verify()
+
+    def test_cascade_delete_events(self):
+        self.goals.add('A')
+        self.goals.add('B', 2)
+        self.goals.add('C', 2)
+        self.goals.add('D', 3)
+        self.goals.toggle_link(1, 4)
+        self.goals.delete(2)
+        assert list(self.goals.events)[-5:-2] == [('delete', 5), ('delete', 3), ('delete', 2)]
+        assert self.goals.all(keys='edge') == {1: {'edge': [4]}, 4: {'edge': []}}
+
+    def test_cycle_check_matches_breadth_first_search(self):
+        def reachable(edges, source, target):
+            front, visited = [source], set()
+            while front:
+                goal = front.pop()
+                visited.add(goal)
+                front.extend(e for e in edges[goal]['edge'] if e not in visited)
+            return target in visited
+        rnd = random.Random(7)
+        for i in range(2, 60):
+            self.goals.add(str(i), rnd.randint(1, i - 1))
+        for _ in range(500):
+            lower, upper = rnd.randint(1, 59), rnd.randint(1, 59)
+            edges = self.goals.all(keys='edge')
+            if lower == upper or upper in edges[lower]['edge']:
+                continue
+            self.goals.toggle_link(lower, upper)
+            linked = upper in self.goals.all(keys='edge')[lower]['edge']
+            assert linked != reachable(edges, upper, lower)
+        assert self.goals.verify()
+
+    def test_top_goals_follow_changes(self):
+        self.goals.add('A')
+        self.goals.add('B')
+        self.goals.add('C', 2)
+        assert self.goals.top_goals() == {3, 4}
+        self.goals.toggle_link(3, 4)
+        assert self.goals.top_goals() == {4}
+        self.goals.select(4)
+        self.goals.toggle_close()
+        assert self.goals.top_goals() == {2, 3}
+        self.goals.select(4)
+        self.goals.toggle_close()
+        assert self.goals.top_goals() == {4}
+        self.goals.toggle_link(2, 4)
+        assert self.goals.top_goals() == {2, 4}
+        self.goals.delete(3)
+        assert self.goals.top_goals() == {2}
+        restored = self.goals_class.build(*self.goals_class.export(self.goals))
+        assert restored.top_goals() == {2}
+
+
+class CompactGoalsTest(GoalsTest):
+    goals_class = CompactGoals
+
+    def test_same_changes_as_goals(self):
+        rnd = random.Random(11)
+        trees = [Enumeration(Zoom(Goals('Root'))), Enumeration(Zoom(CompactGoals('Root')))]
+        actions = [
+            lambda g, x: g.add(str(x)),
+            lambda g, x: g.insert(str(x)),
+            lambda g, x: g.select(x % 10),
+            lambda g, x: g.hold_select(),
+            lambda g, x: g.toggle_link(),
+            lambda g, x: g.toggle_close(),
+            lambda g, x: g.delete(),
+            lambda g, x: g.rename(str(x)),
+            lambda g, x: g.swap_goals(),
+            lambda g, x: g.toggle_zoom(),
+            lambda g, x: g.next_view(),
+        ]
+        for _ in range(3000):
+            action, value = rnd.choice(actions), rnd.randint(0, 100)
+            for tree in trees:
+                action(tree, value)
+            assert trees[0].all('name,edge,open,select,switchable') == \
+                trees[1].all('name,edge,open,select,switchable')
+        assert list(trees[0].events) == list(trees[1].events)
+        assert Goals.export(trees[0].goaltree.goaltree) == \
+            Goals.export(trees[1].goaltree.goaltree)
+        assert trees[1].goaltree.goaltree.verify()
+
+    def test_links_are_merged_into_arrays(self):
+        for i in range(2, 3000):
+            self.goals.add(str(i), i // 2)
+        for i in range(3, 3000, 3):
+            self.goals.toggle_link(1, i)
+        self.goals.delete(4)
+        restored = Goals.build(*CompactGoals.export(self.goals))
+        assert restored.all(keys='edge,open') == self.goals.all(keys='edge,open')
+        assert self.goals.verify()
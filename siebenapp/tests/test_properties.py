@@ -1,6 +1,7 @@
 # coding: utf-8
 import os
 import sqlite3
+from collections import deque
 from contextlib import closing
 
 import pytest
@@ -9,7 +10,7 @@ from hypothesis.strategies import lists, sampled_from, composite, choices, text
 
 from siebenapp.enumeration import Enumeration
 from siebenapp.goaltree import Goals
-from siebenapp.system import run_migrations, save_updates
+from siebenapp.system import ACTIONS, run_migrations, save_updates, write_events
 
 
 settings.register_profile('ci', settings(max_examples=2000))
@@ -37,7 +38,10 @@ def user_actions(draw, skip=None, **lists_kwargs):
 
 
 def build_from(actions, choice_fn, show_notes=True):
-    g = Goals('Root')
+    return apply_to(Goals('Root'), actions, choice_fn, show_notes)
+
+
+def apply_to(g, actions, choice_fn, show_notes=True):
     try:
         for name in actions:
             int_val = 0
@@ -137,6 +141,55 @@ def test_full_export_and_streaming_export_must_be_the_same(actions, ch):
         assert g.all('name,open,edge,select') == ng.all('name,open,edge,select')
 
 
+def dump_tables(conn):
+    with closing(conn.cursor()) as cur:
+        return [sorted(cur.execute('select * from %s' % table))
+                for table in ('goals', 'edges', 'settings')]
+
+
+@given(user_actions(), user_actions(average_size=50), choices())
+def test_compacted_events_must_produce_the_same_database(saved_actions, actions, ch):
+    g = build_from(saved_actions, ch)
+    with closing(sqlite3.connect(':memory:')) as full_conn, \
+            closing(sqlite3.connect(':memory:')) as compact_conn:
+        run_migrations(full_conn)
+        run_migrations(compact_conn)
+        write_events(deque(g.events), full_conn)
+        save_updates(g, compact_conn)
+        apply_to(g, actions, ch)
+        note(g.events)
+        write_events(deque(g.events), full_conn)
+        save_updates(g, compact_conn)
+        assert not g.events
+        assert dump_tables(full_conn) == dump_tables(compact_conn)
+
+
+def write_one_by_one(events, conn):
+    queries = dict(ACTIONS)
+    with closing(conn.cursor()) as cur:
+        for event in events:
+            for query in queries[event[0]]:
+                cur.execute(query, event[1:])
+    conn.commit()
+
+
+@given(user_actions(), user_actions(average_size=50), choices())
+def test_batched_events_must_produce_the_same_database_as_replayed_ones(saved_actions, actions, ch):
+    g = build_from(saved_actions, ch)
+    with closing(sqlite3.connect(':memory:')) as replay_conn, \
+            closing(sqlite3.connect(':memory:')) as batch_conn:
+        run_migrations(replay_conn)
+        run_migrations(batch_conn)
+        write_one_by_one(g.events, replay_conn)
+        write_events(deque(g.events), batch_conn)
+        g.events.clear()
+        apply_to(g, actions, ch)
+        note(g.events)
+        write_one_by_one(g.events, replay_conn)
+        write_events(deque(g.events), batch_conn)
+        assert dump_tables(replay_conn) == dump_tables(batch_conn)
+
+
 @given(text())
 def test_all_goal_names_must_be_saved_correctly(name):
     g = Goals('renamed')
@@ -1,4 +1,5 @@
-from siebenapp.render import min_width
+from siebenapp.goaltree import Goals
+from siebenapp.render import min_width, count_crossings, minimize_crossings, update_tree
 
 
 def test_min_width_examples():
@@ -22,3 +23,96 @@ def test_min_width_examples():
         3: [2],
         4: [1],
     }
+
+
+def test_min_width_prefers_goals_with_more_edges_on_the_same_layer():
+    data = {
+        5: [1, 2],
+        1: [],
+        2: [],
+        3: [2],
+        4: [3, 1],
+    }
+    assert min_width(data, 2) == {
+        0: [1],
+        1: [2],
+        2: [5, 3],
+        3: [4],
+    }
+
+
+def test_min_width_stops_on_goals_with_missing_edges():
+    assert min_width({1: [2], 3: []}, 4) == {0: [3]}
+
+
+def test_count_crossings():
+    edges = {1: [4], 2: [3], 3: [], 4: []}
+    assert count_crossings(edges, {0: [3, 4], 1: [1, 2]}) == 1
+    assert count_crossings(edges, {0: [4, 3], 1: [1, 2]}) == 0
+
+
+def test_count_crossings_of_long_edges():
+    edges = {1: [3], 2: [4], 3: [], 4: [5], 5: []}
+    # 1 -> 3 goes through two layers and may cross 4 -> 5
+    assert count_crossings(edges, {0: [3, 5], 1: [4], 2: [1, 2]}) == 0
+    assert count_crossings(edges, {0: [3, 5], 1: [4], 2: [2, 1]}) == 1
+
+
+def test_minimize_crossings_keeps_goals_on_their_layers():
+    edges = {1: [2, 3], 2: [5], 3: [4], 4: [], 5: []}
+    layers = {0: [4, 5], 1: [2, 3], 2: [1]}
+    assert count_crossings(edges, layers) == 1
+    result = minimize_crossings(edges, layers)
+    assert count_crossings(edges, result) == 0
+    assert {row: sorted(goals) for row, goals in result.items()} == \
+        {row: sorted(goals) for row, goals in layers.items()}
+
+
+def positions(graph):
+    return {goal_id: (attrs['row'], attrs['col']) for goal_id, attrs in graph.items()}
+
+
+def test_update_tree_reuses_layout_when_only_attributes_changed():
+    goals = Goals('Root')
+    goals.add('A')
+    goals.add('B')
+    graph, diff = update_tree(goals)
+    assert positions(graph) == {1: (1, 0), 2: (0, 0), 3: (0, 1)}
+    assert diff == {'moved': set(), 'added': {1, 2, 3}, 'removed': set()}
+    goals.rename('New root')
+    goals.select(3)
+    updated, diff = update_tree(goals, graph)
+    assert positions(updated) == positions(graph)
+    assert updated[1]['name'] == 'New root'
+    assert updated[3]['select'] == 'select'
+    assert diff == {'moved': set(), 'added': set(), 'removed': set()}
+
+
+def test_update_tree_keeps_unaffected_goals_in_place():
+    goals = Goals('Root')
+    for name in 'ABC':
+        goals.add(name)
+    goals.add('D', 2)
+    goals.add('E', 3)
+    graph, _ = update_tree(goals)
+    assert positions(graph) == {1: (2, 0), 2: (1, 0), 3: (1, 1), 4: (0, 0), 5: (0, 1), 6: (0, 2)}
+    goals.add('F', 4)
+    graph, diff = update_tree(goals, graph)
+    # C is moved above its new subgoal
+    assert positions(graph) == {1: (2, 0), 2: (1, 0), 3: (1, 1), 4: (1, 2), 5: (0, 1), 6: (0, 2), 7: (0, 3)}
+    assert diff == {'moved': {4}, 'added': {7}, 'removed': set()}
+    goals.delete(6)
+    graph, diff = update_tree(goals, graph)
+    assert positions(graph) == {1: (2, 0), 2: (1, 0), 3: (1, 1), 4: (1, 2), 5: (0, 1), 7: (0, 3)}
+    assert diff == {'moved': set(), 'added': set(), 'removed': {6}}
+
+
+def test_update_tree_keeps_rows_within_width():
+    goals = Goals('Root')
+    for i in range(8):
+        goals.add(str(i))
+    graph, _ = update_tree(goals)
+    for i in range(30):
+        goals.add('New %d' % i)
+        graph, _ = update_tree(goals, graph)
+        assert max(attrs['col'] for attrs in graph.values()) < 4
@@ -1,9 +1,12 @@
 # coding: utf-8
+from collections import deque
+from io import StringIO
+
 import pytest
 
 from siebenapp.enumeration import Enumeration
 from siebenapp.goaltree import Goals
-from siebenapp.system import dot_export, split_long
+from siebenapp.system import dot_export, write_dot, split_long, compact_events, render_png, RenderCache
 from siebenapp.zoom import Zoom
 
 
@@ -125,11 +128,63 @@ node [shape=box];
 }''' % escaped
 
 
+def test_write_dot_streams_the_same_graph():
+    g = Goals('Root')
+    g.add('Child')
+    g.add('Long multi-word name of the new goal', 2)
+    g.toggle_link(1, 3)
+    out = StringIO()
+    write_dot(g, out)
+    assert out.getvalue() == dot_export(g)
+
+
 @pytest.mark.parametrize('source,result', [
     ('short', 'short'),
     ('10: Example multi-word Sieben label', '10: Example multi-word\nSieben label'),
     ('123: Example very-very long multi-word Sieben label', '123: Example very-very\nlong multi-word Sieben\nlabel'),
     ('43: Manual-placed\nnewlines\nare ignored', '43: Manual-placed\nnewlines\nare\nignored'),
+    ('a' * 30 + ' b c', 'a' * 30 + '\nb c'),
 ])
 def test_split_long_labels(source, result):
     assert split_long(source) == result
+
+
+def test_compact_settings_events():
+    events = deque([('select', 2), ('hold_select', 2), ('select', 3), ('zoom', 3),
+                    ('select', 4), ('zoom', 1)])
+    compact_events(events)
+    assert list(events) == [('hold_select', 2), ('select', 4), ('zoom', 1)]
+
+
+def test_compact_events_of_deleted_goals():
+    events = deque([('add', 5, 'New', True), ('link', 1, 5), ('rename', 'Old', 4),
+                    ('toggle_close', False, 4), ('link', 4, 5), ('delete', 5), ('delete', 4),
+                    ('rename', 'Root', 1)])
+    compact_events(events)
+    assert list(events) == [('delete', 4), ('rename', 'Root', 1)]
+
+
+def test_compact_link_unlink_pairs():
+    events = deque([('link', 1, 2), ('unlink', 1, 2), ('unlink', 2, 3), ('link', 2, 3),
+                    ('link', 3, 4), ('unlink', 3, 4), ('link', 3, 4)])
+    compact_events(events)
+    assert list(events) == [('link', 3, 4)]
+
+
+def test_render_png_passes_graph_through_pipes():
+    dot = dot_export(Goals('Привет'))
+    assert render_png(dot, command=['cat']) == dot.encode('utf-8')
+
+
+def test_render_cache_keeps_recently_used_images():
+    cache = RenderCache(size=2)
+    first, second, third = (RenderCache.key(dot_export(Goals(name))) for name in 'abc')
+    assert first != second
+    assert RenderCache.key(dot_export(Goals('a'))) == first
+    cache.put(first, b'1')
+    cache.put(second, b'2')
+    assert cache.get(first) == b'1'
+    cache.put(third, b'3')
+    assert cache.get(second) is None
+    assert cache.get(first) == b'1'
+    assert cache.get(third) == b'3'
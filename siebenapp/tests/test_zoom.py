@@ -190,3 +190,39 @@ class TestZoom(TestCase):
             1: {'name': 'Root', 'select': 'select', 'open': True},
             2: {'name': 'Intermediate', 'select': None, 'open': True},
         }
+
+    def test_top_goals_are_limited_by_zoom(self):
+        self.goals.add('Zoomed')
+        self.goals.add('Top inside', 2)
+        self.goals.add('Top outside')
+        assert self.goals.top_goals() == {3, 4}
+        self.goals.select(2)
+        self.goals.toggle_zoom()
+        assert self.goals.top_goals() == {3}
+        self.goals.select(3)
+        self.goals.toggle_close()
+        assert self.goals.top_goals() == {2}
+
+    def test_visible_goals_are_updated_without_rebuild(self):
+        self.goals.add('Zoomed')
+        self.goals.add('Outside')
+        self.goals.add('Inside', 2)
+        self.goals.select(2)
+        self.goals.toggle_zoom()
+        visible_goals = self.goals._visible_goals                 # pylint: disable=protected-access
+        assert set(self.goals.all()) == {-1, 2, 4}
+        self.goals.add('New')
+        self.goals.toggle_link(4, 3)
+        assert set(self.goals.all()) == {-1, 2, 3, 4, 5}
+        self.goals.toggle_link(4, 3)
+        assert set(self.goals.all()) == {-1, 2, 4, 5}
+        self.goals.select(4)
+        self.goals.delete()
+        assert set(self.goals.all()) == {-1, 2, 5}
+        # the same set is updated in place instead of being built again
+        assert self.goals._visible_goals is visible_goals       # pylint: disable=protected-access
+        assert self.goals.all() == {
+            -1: {'name': 'Root'},
+            2: {'name': 'Zoomed'},
+            5: {'name': 'New'},
+        }
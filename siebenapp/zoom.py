@@ -1,11 +1,17 @@
-class Zoom:
-    override = ['_build_visible_goals', 'all', 'delete', 'export', 'goaltree',
-                'toggle_close', 'toggle_zoom']
+from itertools import islice
+
 
+class Zoom:
     def __init__(self, goaltree):
         self.goaltree = goaltree
+        # shared with the wrapped goaltree, read often enough to skip __getattr__
+        self.settings = goaltree.settings
+        self.events = goaltree.events
         if 'zoom' not in self.settings:
             self.settings['zoom'] = 1
+        # visible goals are valid for the given zoom root and goaltree revision
+        self._visible_goals = set()
+        self._visible_key = None
 
     def toggle_zoom(self):
         selection = self.settings['selection']
@@ -20,22 +26,44 @@ class Zoom:
         if self.settings['previous_selection'] not in visible_goals:
             self.goaltree.hold_select()
 
-    def all(self, keys='name'):
-        origin_goals = self.goaltree.all(keys)
+    def all(self, keys='name', ids=None):
         if self.settings['zoom'] == 1:
-            return origin_goals
+            return self.goaltree.all(keys, ids)
         visible_goals = self._build_visible_goals()
+        with_root = ids is None or -1 in ids
+        if ids is not None:
+            ids = {g for g in ids if g in visible_goals} | {1}
+        origin_goals = self.goaltree.all(keys, ids)
         zoomed_goals = {k: v for k, v in origin_goals.items()
                         if k in visible_goals}
-        zoomed_goals[-1] = origin_goals[1]
-        if 'edge' in keys:
-            zoomed_goals[-1]['edge'] = [self.settings['zoom']]
+        if with_root:
+            zoomed_goals[-1] = origin_goals[1]
+            if 'edge' in keys:
+                zoomed_goals[-1]['edge'] = [self.settings['zoom']]
+        return zoomed_goals
+
+    def top_goals(self):
+        top_goals = self.goaltree.top_goals()
+        if self.settings['zoom'] == 1:
+            return top_goals
+        zoomed_goals = top_goals & self._build_visible_goals()
+        if 1 in top_goals:
+            zoomed_goals.add(-1)
         return zoomed_goals
 
+    def add(self, name, add_to=0):
+        return self._track(self.goaltree.add, name, add_to)
+
+    def insert(self, name):
+        return self._track(self.goaltree.insert, name)
+
+    def toggle_link(self, lower=0, upper=0):
+        return self._track(self.goaltree.toggle_link, lower, upper)
+
     def toggle_close(self):
         if self.settings['selection'] == self.settings['zoom']:
             self.toggle_zoom()
-        self.goaltree.toggle_close()
+        self._track(self.goaltree.toggle_close)
         if self.settings['selection'] not in self._build_visible_goals():
             self.goaltree.select(self.settings['zoom'])
             self.goaltree.hold_select()
@@ -43,24 +71,70 @@ class Zoom:
     def delete(self, goal_id=0):
         if self.settings['selection'] == self.settings['zoom']:
             self.toggle_zoom()
-        self.goaltree.delete(goal_id)
+        # descendants of the deleted goal may stay without visible parents
+        affected = self._descendants([goal_id or self.settings['selection']]) & \
+            self._visible_goals
+        self._track(self.goaltree.delete, goal_id, affected=affected)
         if self.settings['selection'] != self.settings['zoom']:
             self.goaltree.select(self.settings['zoom'])
             self.goaltree.hold_select()
 
     def _build_visible_goals(self):
-        edges = self.goaltree.all('edge')
-        visible_goals = {self.settings['zoom']}
-        goals_to_visit = set(edges[self.settings['zoom']]['edge'])
-        while goals_to_visit:
-            next_child = goals_to_visit.pop()
-            visible_goals.add(next_child)
-            goals_to_visit.update(edges[next_child]['edge'])
-        return visible_goals
+        key = (self.settings['zoom'], self.goaltree.revision)
+        if key != self._visible_key:
+            self._visible_goals = self._descendants([self.settings['zoom']])
+            self._visible_key = key
+        return self._visible_goals
+
+    def _descendants(self, goals):
+        edges = self.goaltree.edges
+        result, front = set(goals), list(goals)
+        while front:
+            for child in edges.get(front.pop(), []):
+                if child not in result:
+                    result.add(child)
+                    front.append(child)
+        return result
+
+    def _track(self, action, *args, affected=()):
+        # update visible goals using events appended by the wrapped action,
+        # unless they have to be rebuilt anyway
+        key = (self.settings['zoom'], self.goaltree.revision)
+        known_events = len(self.events)
+        result = action(*args)
+        if key == self._visible_key and self.settings['zoom'] == key[0]:
+            self._update_visible_goals(islice(self.events, known_events, None), affected)
+            self._visible_key = (self.settings['zoom'], self.goaltree.revision)
+        return result
+
+    def _update_visible_goals(self, events, affected):
+        visible, goals = self._visible_goals, self.goaltree.goals
+        affected = set(affected)
+        for event in events:
+            if event[0] == 'link' and event[1] in visible and event[2] not in visible:
+                visible.update(self._descendants([event[2]]))
+            elif event[0] == 'unlink' and event[2] in visible:
+                affected.add(event[2])
+            elif event[0] == 'delete':
+                visible.discard(event[1])
+        # affected goals are visible only when reachable from other visible goals
+        affected = self._descendants([g for g in affected if goals.get(g) is not None])
+        visible -= affected
+        parents, edges = self.goaltree.parents, self.goaltree.edges
+        front = [g for g in affected
+                 if g == self.settings['zoom'] or not visible.isdisjoint(parents[g])]
+        while front:
+            goal = front.pop()
+            if goal not in visible:
+                visible.add(goal)
+                front.extend(g for g in edges[goal] if g in affected)
 
-    def __getattribute__(self, item):
-        override = object.__getattribute__(self, 'override')
-        goals = object.__getattribute__(self, 'goaltree')
-        if item in override:
-            return object.__getattribute__(self, item)
-        return getattr(goals, item)
+    def __getattr__(self, item):
+        # only called for attributes not defined in Zoom itself
+        if item == 'goaltree':
+            raise AttributeError(item)
+        value = getattr(self.goaltree, item)
+        if callable(value):
+            # methods of the goaltree are bound once and never change
+            setattr(self, item, value)
+        return value